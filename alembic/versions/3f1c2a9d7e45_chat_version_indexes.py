@@ -0,0 +1,30 @@
+"""chat version indexes
+
+Revision ID: 3f1c2a9d7e45
+Revises: 6b6b8442f981
+Create Date: 2026-10-19 10:12:31.418204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c2a9d7e45'
+down_revision: Union[str, None] = '6b6b8442f981'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_messages_chat_id_id', 'messages', ['chat_id', 'id'])
+    op.create_index('ix_chat_users_user_id', 'chat_users', ['user_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_chat_users_user_id', table_name='chat_users')
+    op.drop_index('ix_messages_chat_id_id', table_name='messages')
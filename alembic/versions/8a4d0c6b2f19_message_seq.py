@@ -0,0 +1,46 @@
+"""message seq
+
+Revision ID: 8a4d0c6b2f19
+Revises: 3f1c2a9d7e45
+Create Date: 2026-10-19 12:40:07.552913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8a4d0c6b2f19'
+down_revision: Union[str, None] = '3f1c2a9d7e45'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('messages', sa.Column('seq', sa.BigInteger(), nullable=True))
+    op.execute(
+        """
+        UPDATE messages AS m
+        SET seq = numbered.seq
+        FROM (
+            SELECT id, row_number() OVER (
+                PARTITION BY chat_id ORDER BY timestamp, id
+            ) AS seq
+            FROM messages
+        ) AS numbered
+        WHERE m.id = numbered.id
+        """
+    )
+    op.alter_column('messages', 'seq', nullable=False)
+    op.create_unique_constraint('uq_messages_chat_id_seq', 'messages', ['chat_id', 'seq'])
+    op.drop_index('ix_messages_chat_id_id', table_name='messages')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index('ix_messages_chat_id_id', 'messages', ['chat_id', 'id'])
+    op.drop_constraint('uq_messages_chat_id_seq', 'messages', type_='unique')
+    op.drop_column('messages', 'seq')
@@ -0,0 +1,42 @@
+"""user search indexes
+
+Revision ID: a5d2e9c41b73
+Revises: f27c9d4e6a18
+Create Date: 2026-10-19 18:02:17.530914
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a5d2e9c41b73'
+down_revision: Union[str, None] = 'f27c9d4e6a18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for column in ('name', 'email'):
+        op.create_index(
+            f'ix_users_{column}_prefix', 'users',
+            [sa.text(f'lower({column}) COLLATE "C"'), 'id'],
+            postgresql_where=sa.text('deleted_at IS NULL'),
+        )
+        op.create_index(
+            f'ix_users_{column}_trgm', 'users',
+            [sa.text(f'lower({column}) gin_trgm_ops')],
+            postgresql_using='gin',
+            postgresql_where=sa.text('deleted_at IS NULL'),
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for column in ('name', 'email'):
+        op.drop_index(f'ix_users_{column}_trgm', table_name='users')
+        op.drop_index(f'ix_users_{column}_prefix', table_name='users')
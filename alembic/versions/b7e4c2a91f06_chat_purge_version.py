@@ -0,0 +1,31 @@
+"""chat purge version
+
+Revision ID: b7e4c2a91f06
+Revises: a5d2e9c41b73
+Create Date: 2026-10-19 18:47:05.318264
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e4c2a91f06'
+down_revision: Union[str, None] = 'a5d2e9c41b73'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        'chats',
+        sa.Column('purge_version', sa.BigInteger(), nullable=False, server_default='0'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('chats', 'purge_version')
@@ -0,0 +1,35 @@
+"""chat delivery mode
+
+Revision ID: c27e5b1d9a63
+Revises: 8a4d0c6b2f19
+Create Date: 2026-10-19 14:05:48.120377
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c27e5b1d9a63'
+down_revision: Union[str, None] = '8a4d0c6b2f19'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+delivery_mode = sa.Enum('push', 'pull', name='delivery_mode')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    delivery_mode.create(op.get_bind(), checkfirst=True)
+    op.add_column(
+        'chats',
+        sa.Column('delivery_mode', delivery_mode, nullable=False, server_default='push'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('chats', 'delivery_mode')
+    delivery_mode.drop(op.get_bind(), checkfirst=True)
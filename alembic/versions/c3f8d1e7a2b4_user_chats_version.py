@@ -0,0 +1,31 @@
+"""user chats version
+
+Revision ID: c3f8d1e7a2b4
+Revises: b7e4c2a91f06
+Create Date: 2026-10-19 19:12:38.604417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3f8d1e7a2b4'
+down_revision: Union[str, None] = 'b7e4c2a91f06'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        'users',
+        sa.Column('chats_version', sa.BigInteger(), nullable=False, server_default='0'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('users', 'chats_version')
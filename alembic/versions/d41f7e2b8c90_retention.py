@@ -0,0 +1,54 @@
+"""retention and batched deletion
+
+Revision ID: d41f7e2b8c90
+Revises: c27e5b1d9a63
+Create Date: 2026-10-19 16:30:12.408113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd41f7e2b8c90'
+down_revision: Union[str, None] = 'c27e5b1d9a63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('chats', sa.Column('retention_days', sa.Integer(), nullable=True))
+    op.add_column(
+        'chats',
+        sa.Column('purged_seq', sa.BigInteger(), nullable=False, server_default='0'),
+    )
+    op.add_column('chats', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.add_column('users', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.create_index(
+        'ix_chats_retention_days', 'chats', ['id'],
+        postgresql_where=sa.text('retention_days IS NOT NULL'),
+    )
+    op.create_index(
+        'ix_chats_deleted_at', 'chats', ['id'],
+        postgresql_where=sa.text('deleted_at IS NOT NULL'),
+    )
+    op.create_index(
+        'ix_users_deleted_at', 'users', ['id'],
+        postgresql_where=sa.text('deleted_at IS NOT NULL'),
+    )
+    op.create_index('ix_messages_sender_id_id', 'messages', ['sender_id', 'id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_sender_id_id', table_name='messages')
+    op.drop_index('ix_users_deleted_at', table_name='users')
+    op.drop_index('ix_chats_deleted_at', table_name='chats')
+    op.drop_index('ix_chats_retention_days', table_name='chats')
+    op.drop_column('users', 'deleted_at')
+    op.drop_column('chats', 'deleted_at')
+    op.drop_column('chats', 'purged_seq')
+    op.drop_column('chats', 'retention_days')
@@ -0,0 +1,48 @@
+"""attachments
+
+Revision ID: e8b3a6c15d27
+Revises: d41f7e2b8c90
+Create Date: 2026-10-19 16:52:37.914520
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8b3a6c15d27'
+down_revision: Union[str, None] = 'd41f7e2b8c90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'attachments',
+        sa.Column('id', sa.Integer(), primary_key=True, index=True),
+        sa.Column('sha256', sa.String(length=64), nullable=False, index=True),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('content_type', sa.String(), nullable=False),
+        sa.Column('filename', sa.String(), nullable=False),
+        sa.Column('uploader_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=True, index=True),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.func.now()),
+    )
+    op.add_column('messages', sa.Column('attachment_id', sa.Integer(), nullable=True))
+    op.create_foreign_key(
+        'messages_attachment_id_fkey', 'messages', 'attachments', ['attachment_id'], ['id']
+    )
+    op.create_index(
+        'ix_messages_attachment_id', 'messages', ['attachment_id'],
+        postgresql_where=sa.text('attachment_id IS NOT NULL'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_attachment_id', table_name='messages')
+    op.drop_constraint('messages_attachment_id_fkey', 'messages', type_='foreignkey')
+    op.drop_column('messages', 'attachment_id')
+    op.drop_table('attachments')
@@ -0,0 +1,31 @@
+"""pull chats index
+
+Revision ID: f27c9d4e6a18
+Revises: e8b3a6c15d27
+Create Date: 2026-10-19 17:08:44.205731
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f27c9d4e6a18'
+down_revision: Union[str, None] = 'e8b3a6c15d27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'ix_chats_delivery_mode_pull', 'chats', ['id'],
+        postgresql_where=sa.text("delivery_mode = 'pull'"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_chats_delivery_mode_pull', table_name='chats')
@@ -1,16 +1,24 @@
+import asyncio
 import os
+from typing import Optional
 
 from dotenv import load_dotenv
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
 from sqlalchemy.orm import declarative_base
 import logging
 
+from app.service.replica import ReplicaRouter
+
+# Единственное место, где читается .env: app.db импортируется раньше
+# остальных модулей приложения, которые берут настройки из окружения.
 load_dotenv()
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s"
-)
 logger = logging.getLogger("db")
 
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
@@ -22,17 +30,109 @@ SQLALCHEMY_DATABASE_URL = (
     f"{os.getenv('POSTGRES_HOST')}:{os.getenv('POSTGRES_PORT')}/"
     f"{os.getenv('POSTGRES_NAME')}"
 )
-logger.info("Формируется строка подключения к базе данных")
 
-engine = create_async_engine(SQLALCHEMY_DATABASE_URL, echo=True)
-logger.info("Создан движок SQLAlchemy (async)")
-AsyncSessionLocal = async_sessionmaker(
-    engine, class_=AsyncSession, expire_on_commit=False
+SQLALCHEMY_REPLICA_URL = None
+if os.getenv("POSTGRES_REPLICA_HOST"):
+    SQLALCHEMY_REPLICA_URL = (
+        f"postgresql+asyncpg://{os.getenv('POSTGRES_REPLICA_USER', os.getenv('POSTGRES_USER'))}:"
+        f"{os.getenv('POSTGRES_REPLICA_PASSWORD', os.getenv('POSTGRES_PASSWORD'))}@"
+        f"{os.getenv('POSTGRES_REPLICA_HOST')}:{os.getenv('POSTGRES_REPLICA_PORT', '5432')}/"
+        f"{os.getenv('POSTGRES_REPLICA_NAME', os.getenv('POSTGRES_NAME'))}"
+    )
+
+SQL_ECHO = os.getenv("SQL_ECHO", "false").lower() in ("1", "true", "yes")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_WARM = int(os.getenv("DB_POOL_WARM", 2))
+
+# Движки создаются в init_engine() при старте приложения, а не при импорте.
+# Фабрики сессий существуют сразу и привязываются к движку там же, поэтому
+# модули могут импортировать AsyncSessionLocal заранее.
+engine: Optional[AsyncEngine] = None
+replica_engine: Optional[AsyncEngine] = None
+AsyncSessionLocal = async_sessionmaker(class_=AsyncSession, expire_on_commit=False)
+AsyncReplicaSessionLocal = AsyncSessionLocal
+
+replica_router = ReplicaRouter(
+    None,
+    max_lag=float(os.getenv("REPLICA_MAX_LAG", 5)),
+    check_interval=float(os.getenv("REPLICA_CHECK_INTERVAL", 5)),
+    sticky_window=float(os.getenv("REPLICA_STICKY_SECONDS", 10)),
 )
 Base = declarative_base()
 
 
+def init_engine() -> AsyncEngine:
+    global engine, replica_engine, AsyncReplicaSessionLocal
+    if engine is not None:
+        return engine
+    engine = create_async_engine(
+        SQLALCHEMY_DATABASE_URL,
+        echo=SQL_ECHO,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_pre_ping=True,
+    )
+    AsyncSessionLocal.configure(bind=engine)
+    logger.info("Создан движок SQLAlchemy (async)")
+
+    if SQLALCHEMY_REPLICA_URL:
+        replica_engine = create_async_engine(
+            SQLALCHEMY_REPLICA_URL,
+            echo=SQL_ECHO,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_pre_ping=True,
+            execution_options={"postgresql_readonly": True},
+        )
+        AsyncReplicaSessionLocal = async_sessionmaker(
+            replica_engine, class_=AsyncSession, expire_on_commit=False
+        )
+        replica_router.engine = replica_engine
+        logger.info("Создан движок реплики SQLAlchemy (async, только чтение)")
+    return engine
+
+
+async def warm_pool(target: AsyncEngine, size: int) -> None:
+    """Открывает size соединений заранее и возвращает их в пул."""
+    if size <= 0:
+        return
+
+    async def open_one():
+        conn = await target.connect()
+        await conn.execute(text("SELECT 1"))
+        return conn
+
+    conns = await asyncio.gather(*(open_one() for _ in range(size)))
+    for conn in conns:
+        await conn.close()
+
+
+async def dispose_engine() -> None:
+    global engine, replica_engine, AsyncReplicaSessionLocal
+    if replica_engine is not None:
+        await replica_engine.dispose()
+        replica_engine = None
+        replica_router.engine = None
+        AsyncReplicaSessionLocal = AsyncSessionLocal
+    if engine is not None:
+        await engine.dispose()
+        engine = None
+        AsyncSessionLocal.configure(bind=None)
+        logger.info("Пул соединений закрыт")
+
+
+def is_replica_session(session: AsyncSession) -> bool:
+    return replica_engine is not None and session.bind is replica_engine
+
+
 async def get_async_session():
     async with AsyncSessionLocal() as session:
         logger.debug("Создана новая асинхронная сессия")
         yield session
+
+
+async def get_read_sessionmaker(user_id: int = None):
+    if await replica_router.use_replica(user_id):
+        return AsyncReplicaSessionLocal
+    return AsyncSessionLocal
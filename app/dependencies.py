@@ -1,10 +1,18 @@
+import os
+
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db import JWT_ALGORITHM, JWT_SECRET_KEY, get_async_session
+from app.db import (
+    JWT_ALGORITHM,
+    JWT_SECRET_KEY,
+    get_async_session,
+    get_read_sessionmaker,
+)
 from app.models.tables import User
+from app.utils.jwt import get_current_user as get_current_user_jwt
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
@@ -25,6 +33,34 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
     user = await db.get(User, user_id)
-    if user is None:
+    if user is None or user.deleted_at is not None:
         raise credentials_exception
     return user
+
+
+async def get_read_session(
+    current_user: User = Depends(get_current_user_jwt),
+    auth_session: AsyncSession = Depends(get_async_session),
+):
+    """Сессия для эндпоинтов только на чтение: реплика, если она здорова
+    и пользователь недавно ничего не писал, иначе primary."""
+    # Пользователь загружен через сессию primary, и ее транзакция держала бы
+    # соединение пула primary до конца запроса. Закрытие возвращает его сразу;
+    # загруженные поля пользователя остаются доступны.
+    await auth_session.close()
+    sessionmaker = await get_read_sessionmaker(current_user.id)
+    async with sessionmaker() as session:
+        yield session
+
+
+ADMIN_EMAILS = {
+    email.strip().lower()
+    for email in os.getenv("ADMIN_EMAILS", "").split(",")
+    if email.strip()
+}
+
+
+async def get_admin_user(current_user: User = Depends(get_current_user_jwt)) -> User:
+    if (current_user.email or "").lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Недостаточно прав")
+    return current_user
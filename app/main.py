@@ -1,36 +1,89 @@
+import logging
+import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
-import logging
+from app import db
+from app.routers import admin, attachments, auth, chat, users
+from app.service.profiler import ProfilingMiddleware, profiler
+from app.service.retention import purger
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s"
-)
 logger = logging.getLogger("messenger_api")
 
-from app.routers import auth, chat
+STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
 
-app = FastAPI(title="Мессенджер API", description="API для мессенджера", version="1.0")
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+def configure_logging() -> None:
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+    )
 
-app.include_router(auth.router)
-app.include_router(chat.router)
 
-logger.info("Маршруты подключены: auth, chat")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    engine = db.init_engine()
+    profiler.instrument(engine)
+    if db.replica_engine is not None:
+        profiler.instrument(db.replica_engine)
 
-app.mount("/", StaticFiles(directory="app/static", html=True), name="static")
+    await db.warm_pool(engine, db.DB_POOL_WARM)
+    if db.replica_engine is not None:
+        await db.warm_pool(db.replica_engine, db.DB_POOL_WARM)
+        await db.replica_router.check()
+    async with db.AsyncSessionLocal() as session:
+        await chat.warm_up(session)
+    chat.manager.wheel.start()
+    purger.start()
+    logger.info(f"Приложение запущено, в пуле открыто соединений: {db.DB_POOL_WARM}")
+    try:
+        yield
+    finally:
+        await chat.manager.shutdown()
+        await purger.stop()
+        await db.dispose_engine()
+        logger.info("Приложение остановлено")
+        for handler in logging.getLogger().handlers:
+            handler.flush()
 
 
-@app.get("/health")
 async def health_check():
     logger.info("Health check endpoint был вызван")
     return {"status": "все ок👌"}
+
+
+def create_app() -> FastAPI:
+    """Собирает приложение. Движок БД и фоновые задачи поднимаются в lifespan.
+
+    uvicorn app.main:create_app --factory
+    """
+    configure_logging()
+    app = FastAPI(
+        title="Мессенджер API",
+        description="API для мессенджера",
+        version="1.0",
+        lifespan=lifespan,
+    )
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.add_middleware(ProfilingMiddleware, profiler=profiler)
+
+    app.add_api_route("/health", health_check, methods=["GET"])
+    app.include_router(auth.router)
+    app.include_router(chat.router)
+    app.include_router(users.router)
+    app.include_router(attachments.router)
+    app.include_router(admin.router)
+    logger.info("Маршруты подключены: auth, chat, users, attachments, admin")
+
+    app.mount("/", StaticFiles(directory=STATIC_DIR, html=True), name="static")
+    return app
@@ -0,0 +1,28 @@
+from app.models.tables import Chat, Message
+
+# Наборы колонок для Core-запросов на чтение. Строки из них сериализуются
+# напрямую, без ORM-объектов в identity map и без from_attributes-валидации.
+# Порядок и имена совпадают с полями схем Chat и Message из app.schemas.tables.
+
+CHAT_COLUMNS = (
+    Chat.id,
+    Chat.name,
+    Chat.chat_type,
+    Chat.delivery_mode,
+    Chat.retention_days,
+)
+
+MESSAGE_COLUMNS = (
+    Message.id,
+    Message.text,
+    Message.chat_id,
+    Message.sender_id,
+    Message.seq,
+    Message.client_message_id,
+    Message.attachment_id,
+    Message.created_at,
+)
+
+
+def rows_to_dicts(result) -> list[dict]:
+    return [row._asdict() for row in result]
@@ -1,14 +1,18 @@
 from datetime import datetime
 
 from sqlalchemy import (
+    BigInteger,
     Boolean,
     Column,
     DateTime,
     Enum,
     ForeignKey,
+    Index,
     Integer,
     String,
     Table,
+    UniqueConstraint,
+    text,
 )
 from sqlalchemy.orm import relationship
 
@@ -26,19 +30,57 @@ chat_users = Table(
     Base.metadata,
     Column("chat_id", ForeignKey("chats.id"), primary_key=True),
     Column("user_id", ForeignKey("users.id"), primary_key=True),
+    Index("ix_chat_users_user_id", "user_id"),
 )
 
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        Index("ix_users_deleted_at", "id", postgresql_where=text("deleted_at IS NOT NULL")),
+        # Поиск пользователей (app/service/directory.py): префикс - диапазон по
+        # btree в C-сопоставлении, нечеткий поиск - триграммы pg_trgm. Только
+        # для Postgres: SQLite в бенчмарках таких выражений не понимает.
+        Index(
+            "ix_users_name_prefix",
+            text('lower(name) COLLATE "C"'),
+            "id",
+            postgresql_where=text("deleted_at IS NULL"),
+        ).ddl_if(dialect="postgresql"),
+        Index(
+            "ix_users_email_prefix",
+            text('lower(email) COLLATE "C"'),
+            "id",
+            postgresql_where=text("deleted_at IS NULL"),
+        ).ddl_if(dialect="postgresql"),
+        Index(
+            "ix_users_name_trgm",
+            text("lower(name) gin_trgm_ops"),
+            postgresql_using="gin",
+            postgresql_where=text("deleted_at IS NULL"),
+        ).ddl_if(dialect="postgresql"),
+        Index(
+            "ix_users_email_trgm",
+            text("lower(email) gin_trgm_ops"),
+            postgresql_using="gin",
+            postgresql_where=text("deleted_at IS NULL"),
+        ).ddl_if(dialect="postgresql"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String)
     email = Column(String, unique=True)
     password = Column(String)
+    deleted_at = Column(DateTime, nullable=True)
+    chats_version = Column(BigInteger, nullable=False, default=0, server_default="0")
 
     groups = relationship("Group", secondary=group_members, back_populates="members")
+    # Сообщения удаляются пачками в RetentionPurger до удаления пользователя,
+    # ORM не должна загружать их все ради каскада.
     messages = relationship(
-        "Message", back_populates="sender", cascade="all, delete-orphan"
+        "Message",
+        back_populates="sender",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
     )
     chats = relationship(
         "Chat",
@@ -49,12 +91,38 @@ class User(Base):
 
 class Chat(Base):
     __tablename__ = "chats"
+    __table_args__ = (
+        Index(
+            "ix_chats_retention_days",
+            "id",
+            postgresql_where=text("retention_days IS NOT NULL"),
+        ),
+        Index("ix_chats_deleted_at", "id", postgresql_where=text("deleted_at IS NOT NULL")),
+        Index(
+            "ix_chats_delivery_mode_pull",
+            "id",
+            postgresql_where=text("delivery_mode = 'pull'"),
+        ),
+    )
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String)
     chat_type = Column(Enum("private", "group", name="chat_type"), default="private")
+    delivery_mode = Column(
+        Enum("push", "pull", name="delivery_mode"),
+        nullable=False,
+        default="push",
+        server_default="push",
+    )
+    retention_days = Column(Integer, nullable=True)
+    purged_seq = Column(BigInteger, nullable=False, default=0, server_default="0")
+    purge_version = Column(BigInteger, nullable=False, default=0, server_default="0")
+    deleted_at = Column(DateTime, nullable=True)
 
     messages = relationship(
-        "Message", back_populates="chat", cascade="all, delete-orphan"
+        "Message",
+        back_populates="chat",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
     )
     members = relationship(
         "User",
@@ -75,12 +143,37 @@ class Group(Base):
     chat = relationship("Chat", back_populates="group", uselist=False)
 
 
+class Attachment(Base):
+    """Загруженный файл. Содержимое лежит на диске под своим sha256, поэтому
+    один и тот же файл, загруженный несколько раз, хранится один раз."""
+
+    __tablename__ = "attachments"
+    id = Column(Integer, primary_key=True, index=True)
+    sha256 = Column(String(64), nullable=False, index=True)
+    size = Column(BigInteger, nullable=False)
+    content_type = Column(String, nullable=False)
+    filename = Column(String, nullable=False)
+    uploader_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        UniqueConstraint("chat_id", "seq", name="uq_messages_chat_id_seq"),
+        Index("ix_messages_sender_id_id", "sender_id", "id"),
+        Index(
+            "ix_messages_attachment_id",
+            "attachment_id",
+            postgresql_where=text("attachment_id IS NOT NULL"),
+        ),
+    )
     id = Column(Integer, primary_key=True, index=True)
     text = Column(String, nullable=False)
     chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False)
     sender_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    seq = Column(BigInteger, nullable=False)
+    attachment_id = Column(Integer, ForeignKey("attachments.id"), nullable=True)
     timestamp = Column(DateTime(timezone=True))
     client_message_id = Column(String, unique=True, nullable=True, index=True)
     is_read = Column(Boolean, default=False)
@@ -88,3 +181,4 @@ class Message(Base):
 
     sender = relationship("User", back_populates="messages")
     chat = relationship("Chat", back_populates="messages")
+    attachment = relationship("Attachment")
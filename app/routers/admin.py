@@ -0,0 +1,63 @@
+from fastapi import APIRouter, Depends, HTTPException
+
+from app.dependencies import get_admin_user
+from app.service.admission import admission
+from app.service.profiler import profiler
+from app.service.retention import purger
+
+import logging
+
+logger = logging.getLogger("admin")
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["admin"],
+    dependencies=[Depends(get_admin_user)],
+)
+
+
+@router.get("/profiles")
+async def list_profiles():
+    """Последние снятые профили, новые первыми."""
+    return {
+        "sample_rate": profiler.sample_rate,
+        "max_items": profiler.store.max_items,
+        "items": [record.summary() for record in profiler.store.list()],
+    }
+
+
+@router.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str):
+    record = profiler.store.get(profile_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    return record.to_dict()
+
+
+@router.delete("/profiles", status_code=204)
+async def clear_profiles():
+    profiler.store.clear()
+    logger.info("Хранилище профилей очищено")
+
+
+@router.get("/retention")
+async def retention_status():
+    """Метрики фоновой очистки по сроку хранения."""
+    return {
+        "global_days": purger.global_days,
+        "batch_size": purger.batch_size,
+        "interval": purger.interval,
+        **purger.stats,
+    }
+
+
+@router.post("/retention/run", status_code=202)
+async def run_retention():
+    purger.wake()
+    return {"status": "scheduled"}
+
+
+@router.get("/admission")
+async def admission_status():
+    """Текущий лимит допуска, задержка и счетчики отклоненных запросов."""
+    return admission.stats()
@@ -0,0 +1,101 @@
+import os
+from typing import Optional
+from urllib.parse import quote
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import get_async_session
+from app.models.tables import Attachment, User
+from app.schemas.tables import Attachment as AttachmentSchema
+from app.service.attachments import (
+    ATTACHMENTS_MAX_SIZE,
+    AttachmentTooLarge,
+    attachment_meta,
+    blob_key,
+    blob_path,
+    get_accessible,
+    store_stream,
+)
+from app.service.versions import etag_matches
+from app.utils.jwt import get_current_user
+
+import logging
+
+logger = logging.getLogger("attachments")
+
+router = APIRouter(tags=["attachments"])
+
+# Если задан, файл отдает nginx через X-Accel-Redirect (sendfile), а приложение
+# только проверяет доступ. Префикс должен быть internal-location, смотрящей
+# в ATTACHMENTS_DIR.
+ATTACHMENTS_ACCEL_PREFIX = os.getenv("ATTACHMENTS_ACCEL_PREFIX")
+ATTACHMENT_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+
+@router.post("/attachments", response_model=AttachmentSchema, status_code=201)
+async def upload_attachment(
+    request: Request,
+    filename: str = Query(..., min_length=1, max_length=255),
+    content_type: str = Header(default="application/octet-stream"),
+    content_length: Optional[int] = Header(default=None),
+    session: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user),
+):
+    """Загрузка файла телом запроса как есть, без multipart.
+
+    Тело читается потоком и пишется на диск по мере прихода, в памяти его
+    целиком нет.
+    """
+    logger.info(f"Загрузка вложения {filename} пользователем {current_user.id}")
+    if content_length is not None and content_length > ATTACHMENTS_MAX_SIZE:
+        raise HTTPException(status_code=413, detail="Файл слишком большой")
+    try:
+        sha256, size = await store_stream(request.stream())
+    except AttachmentTooLarge:
+        raise HTTPException(status_code=413, detail="Файл слишком большой")
+    attachment = Attachment(
+        sha256=sha256,
+        size=size,
+        content_type=content_type,
+        filename=os.path.basename(filename),
+        uploader_id=current_user.id,
+    )
+    session.add(attachment)
+    await session.commit()
+    logger.info(f"Вложение {attachment.id} сохранено: {sha256}, {size} байт")
+    return attachment_meta(attachment)
+
+
+@router.api_route("/attachments/{attachment_id}", methods=["GET", "HEAD"])
+async def download_attachment(
+    attachment_id: int,
+    if_none_match: Optional[str] = Header(default=None),
+    session: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user),
+):
+    """Отдает файл с поддержкой Range. Содержимое по id не меняется, поэтому
+    ответ кешируется навсегда, а ETag - это sha256."""
+    attachment = await get_accessible(session, attachment_id, current_user.id)
+    if attachment is None:
+        raise HTTPException(status_code=404, detail="Вложение не найдено")
+    etag = f'"{attachment.sha256}"'
+    headers = {"ETag": etag, "Cache-Control": ATTACHMENT_CACHE_CONTROL}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    if ATTACHMENTS_ACCEL_PREFIX:
+        return Response(
+            headers={
+                **headers,
+                "X-Accel-Redirect": f"{ATTACHMENTS_ACCEL_PREFIX.rstrip('/')}/{blob_key(attachment.sha256)}",
+                "Content-Type": attachment.content_type,
+                "Content-Disposition": f"attachment; filename*=utf-8''{quote(attachment.filename)}",
+            }
+        )
+    return FileResponse(
+        blob_path(attachment.sha256),
+        media_type=attachment.content_type,
+        filename=attachment.filename,
+        headers=headers,
+    )
@@ -1,23 +1,24 @@
 from datetime import datetime, timedelta
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
-from sqlalchemy import select
+from sqlalchemy import delete, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..db import get_async_session
 from ..models.tables import User as ORMUser
+from ..models.tables import chat_users, group_members
 from ..schemas.auth import LoginRequest, TokenResponse
 from ..schemas.tables import User, UserCreate
+from ..service.retention import purger
+from ..service.versions import versions
 from ..utils.jwt import create_jwt_token, verify_jwt_token
+from .chat import mailbox, manager
+from .users import search_cache
 
 import logging
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s"
-)
 logger = logging.getLogger("auth")
 
 router = APIRouter(
@@ -62,12 +63,20 @@ async def get_current_user_from_token(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    stmt = select(ORMUser).where(ORMUser.email == payload["sub"])
-    result = await db.execute(stmt)
-    user = result.scalar_one_or_none()
+    # Пользователь ищется по user_id, а не по email из sub: email удаленного
+    # пользователя освобождается, и старый токен иначе открыл бы новый аккаунт
+    # с тем же email.
+    user_id = payload.get("user_id")
+    if user_id is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Неверный или истекший токен",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    user = await db.get(ORMUser, user_id)
 
-    if not user:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    if not user or user.deleted_at is not None:
+        raise HTTPException(status_code=401, detail="Пользователь не найден")
     logger.info(f"Аутентифицирован пользователь: {user.email}")
     return user
 
@@ -134,3 +143,40 @@ async def get_current_user(
 ):
     logger.info(f"Получение текущего пользователя: {current_user.email}")
     return current_user
+
+
+@router.delete(
+    "/me",
+    status_code=204,
+    summary="Удаление текущего пользователя",
+    description="Пользователь сразу теряет доступ, сообщения удаляются в фоне пачками",
+)
+async def delete_current_user(
+    current_user: ORMUser = Depends(get_current_user_from_token),
+    db: AsyncSession = Depends(get_async_session),
+):
+    logger.info(f"Удаление пользователя: {current_user.email}")
+    chat_ids = (
+        await db.scalars(
+            select(chat_users.c.chat_id).where(chat_users.c.user_id == current_user.id)
+        )
+    ).all()
+    member_ids = (
+        await db.scalars(
+            select(chat_users.c.user_id).where(chat_users.c.chat_id.in_(chat_ids))
+        )
+    ).all()
+    # Email освобождается сразу, чтобы с ним можно было зарегистрироваться снова.
+    current_user.email = None
+    current_user.deleted_at = datetime.utcnow()
+    await db.execute(delete(chat_users).where(chat_users.c.user_id == current_user.id))
+    await db.execute(delete(group_members).where(group_members.c.user_id == current_user.id))
+    await versions.bump_users(db, member_ids)
+    await db.commit()
+    versions.invalidate_users(member_ids)
+    mailbox.forget_members(chat_ids)
+    mailbox.forget_user(current_user.id)
+    search_cache.clear()
+    await manager.drop_user(current_user.id)
+    purger.wake()
+    return Response(status_code=204)
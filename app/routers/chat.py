@@ -1,45 +1,365 @@
-import uuid
+import math
+import os
 from datetime import datetime
-from typing import List
+from json import JSONDecodeError
+from typing import List, Optional
 
 from fastapi import (
     APIRouter,
     Depends,
+    Header,
     HTTPException,
     Query,
+    Response,
     WebSocket,
     WebSocketDisconnect,
 )
-from sqlalchemy import func, insert, select
-from sqlalchemy.exc import IntegrityError
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.exc import (
+    DBAPIError,
+    IntegrityError,
+    InterfaceError,
+    OperationalError,
+    SQLAlchemyError,
+)
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
-from app.db import get_async_session
+from app.db import (
+    AsyncSessionLocal,
+    get_async_session,
+    get_read_sessionmaker,
+    is_replica_session,
+    replica_router,
+)
+from app.dependencies import get_read_session
+from app.models.projections import CHAT_COLUMNS, MESSAGE_COLUMNS, rows_to_dicts
 from app.models.tables import Chat, Group, Message, User, chat_users, group_members
 from app.schemas.tables import (
     Chat as ChatSchema,
 )
 from app.schemas.tables import (
     ChatCreate,
+    ChatDeliveryUpdate,
+    ChatMembersResult,
+    ChatMembersUpdate,
+    ChatRetentionUpdate,
     MessageCreate,
     MessageHistoryResponse,
 )
 from app.schemas.tables import (
     Message as MessageSchema,
 )
+from app.service.admission import READ, SEND, admission
+from app.service.attachments import get_accessible
 from app.service.connection_manager import ConnectionManager
+from app.service.history_export import iter_history_ndjson
+from app.service.mailbox import Mailbox
+from app.service.membership import add_members, remove_members
+from app.service.messages import (
+    MissingReference,
+    SequenceConflict,
+    create_message,
+    message_event,
+    sequencer,
+)
+from app.service.profiler import PROFILE_HEADER, profiler
+from app.service.rate_limiter import MessageRateLimiter
+from app.service.retention import purger
+from app.service.versions import etag_matches, versions
 from app.utils.jwt import get_current_user, get_current_user_ws
 import logging
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s"
-)
 logger = logging.getLogger("chat")
 
 router = APIRouter(tags=["chat"])
-manager = ConnectionManager()
+manager = ConnectionManager(
+    ping_interval=float(os.getenv("WS_PING_INTERVAL", 20)),
+    idle_timeout=float(os.getenv("WS_IDLE_TIMEOUT", 60)),
+    notify_interval=float(os.getenv("WS_NOTIFY_INTERVAL", 1)),
+    send_timeout=float(os.getenv("WS_SEND_TIMEOUT", 5)),
+)
+mailbox = Mailbox(
+    max_chats=int(os.getenv("MAILBOX_MAX_CHATS", 200)),
+    max_users=int(os.getenv("MAILBOX_MAX_USERS", 100_000)),
+    members_ttl=float(os.getenv("MAILBOX_MEMBERS_TTL", 30)),
+    max_fanout=int(os.getenv("MAILBOX_MAX_FANOUT", 1000)),
+    max_heads=int(os.getenv("MAILBOX_MAX_HEADS", 100_000)),
+)
+rate_limiter = MessageRateLimiter(
+    user_rate=float(os.getenv("RATE_LIMIT_USER_RATE", 5)),
+    user_burst=float(os.getenv("RATE_LIMIT_USER_BURST", 20)),
+    chat_rate=float(os.getenv("RATE_LIMIT_CHAT_RATE", 50)),
+    chat_burst=float(os.getenv("RATE_LIMIT_CHAT_BURST", 200)),
+    max_keys=int(os.getenv("RATE_LIMIT_MAX_KEYS", 100_000)),
+)
+
+# Сколько секунд клиент может не перепроверять полную пачку сообщений: за
+# это время до него доходит удаление сообщений вместе с пользователем.
+BATCH_MAX_AGE = int(os.getenv("BATCH_MAX_AGE", 3600))
+
+# Через сколько секунд повторять отправку после конфликта seq.
+SEQUENCE_RETRY_AFTER = 1
+
+# Ошибки, после которых лимит допуска снижается: таймаут ожидания пула и
+# отказ/обрыв соединения с БД. Ошибки данных и ограничений (DataError,
+# IntegrityError) вызывает сам запрос клиента, и лимит они не снижают.
+OVERLOAD_ERRORS = (PoolTimeoutError, OperationalError, InterfaceError)
+
+
+def is_overload(e: BaseException) -> bool:
+    return isinstance(e, OVERLOAD_ERRORS) or (
+        isinstance(e, DBAPIError) and e.connection_invalidated
+    )
+
+
+def admit(priority: str) -> float:
+    """Допуск запроса контроллером нагрузки, иначе 503 с Retry-After."""
+    started = admission.try_acquire(priority)
+    if started is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Сервер перегружен, попробуйте позже",
+            headers={"Retry-After": admission.retry_after_header()},
+        )
+    return started
+
+
+def admitted(priority: str):
+    """Зависимость: admit на время обработчика.
+
+    Выход из yield-зависимости происходит до отправки тела ответа, поэтому
+    потоковым ответам она не подходит - для них есть AdmittedStream.
+    """
+
+    async def dependency():
+        started = admit(priority)
+        dropped = False
+        try:
+            yield
+        except SQLAlchemyError as e:
+            dropped = is_overload(e)
+            raise
+        finally:
+            admission.release(priority, started, dropped)
+
+    return Depends(dependency)
+
+
+class AdmittedStream:
+    """Тело StreamingResponse, которое держит место в контроллере нагрузки,
+    пока тело не отдано целиком, не упало или не брошено.
+
+    Задержкой запроса считается время до первого куска: дальше темп задает
+    клиент, и долгая выгрузка не должна снижать лимит. Брошенное тело (клиент
+    отключился, отправка не началась) освобождает место при сборке мусора.
+    """
+
+    def __init__(self, body, priority: str, started: float):
+        self.body = body
+        self.priority = priority
+        self.started: Optional[float] = started
+        self.sampled = False
+
+    def release(self, dropped: bool = False) -> None:
+        if self.started is not None:
+            admission.release(
+                self.priority, self.started, dropped, sample=not self.sampled
+            )
+            self.started = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            chunk = await self.body.__anext__()
+        except StopAsyncIteration:
+            self.release()
+            raise
+        except BaseException as e:
+            self.release(dropped=is_overload(e))
+            raise
+        if not self.sampled and self.started is not None:
+            admission.observe(self.started)
+            self.sampled = True
+        return chunk
+
+    def __del__(self):
+        self.release()
+
+
+async def deliver(session: AsyncSession, msg: Message, attachment=None) -> None:
+    """Рассылает сообщение подписчикам чата, остальным участникам - в почтовый ящик.
+
+    В чатах pull и в больших чатах сдвигается только общая отметка чата:
+    работа на отправку не зависит от числа участников.
+    """
+    await manager.publish(msg.chat_id, message_event(msg, attachment))
+    if manager.delivery_modes.get(msg.chat_id) == "pull":
+        mailbox.advance(msg.chat_id, msg.id, msg.seq)
+        return
+    members = await mailbox.members(session, msg.chat_id)
+    if len(members) > mailbox.max_fanout:
+        mailbox.advance(msg.chat_id, msg.id, msg.seq)
+        return
+    offline = members - manager.subscribed_users(msg.chat_id) - {msg.sender_id}
+    mailbox.append(msg.chat_id, msg.id, msg.seq, offline)
+
+
+async def send_catch_up(
+    websocket: WebSocket, user_id: int, chat_ids, complete: bool = False
+) -> None:
+    frame = mailbox.drain(user_id, chat_ids, complete)
+    if frame is not None:
+        await websocket.send_json(frame)
+
+
+def ack_mailbox(websocket: WebSocket, user_id: int, data: dict) -> None:
+    """Клиент подтвердил кадр catch_up: записи его чатов до курсора удаляются."""
+    cursor = data.get("cursor")
+    state = manager.connections.get(websocket)
+    if isinstance(cursor, int) and state is not None:
+        mailbox.ack(user_id, cursor, state.chats)
+
+
+async def warm_up(session: AsyncSession) -> None:
+    """Загружает режимы доставки чатов в режиме pull до первого запроса.
+
+    Без этого HTTP-отправка в pull-чат до первого WS-подключения к нему
+    разослала бы тело сообщения всем участникам.
+    """
+    pull_chats = (
+        await session.scalars(
+            select(Chat.id).where(Chat.delivery_mode == "pull", Chat.deleted_at.is_(None))
+        )
+    ).all()
+    for chat_id in pull_chats:
+        manager.set_delivery_mode(chat_id, "pull")
+    logger.info(f"Загружены режимы доставки: {len(pull_chats)} чатов в режиме pull")
+
+
+async def handle_ws_event(
+    websocket: WebSocket,
+    session: AsyncSession,
+    user_id: int,
+    chat_id: int,
+    data: dict,
+) -> None:
+    event_type = data.get("type")
+    if event_type not in ("message", "read"):
+        return
+    # Лимит - на отправку: отметки о прочтении не должны съедать бюджет
+    # сообщений чата и самого читателя.
+    retry_after = rate_limiter.acquire(user_id, chat_id) if event_type == "message" else 0
+    if retry_after:
+        logger.warning(f"WS: превышен лимит для пользователя {user_id} в чате {chat_id}")
+        await websocket.send_json(
+            {
+                "type": "error",
+                "code": "rate_limited",
+                "event": event_type,
+                "chat_id": chat_id,
+                "retry_after": round(retry_after, 3),
+            }
+        )
+        return
+    # Отправка идет с высшим приоритетом: при перегрузке первыми режутся чтения.
+    priority = SEND if event_type == "message" else READ
+    started = admission.try_acquire(priority)
+    if started is None:
+        await websocket.send_json(
+            {
+                "type": "backoff",
+                "event": event_type,
+                "chat_id": chat_id,
+                "retry_after": round(admission.retry_after(), 3),
+            }
+        )
+        return
+    dropped = False
+    try:
+        await process_ws_event(websocket, session, user_id, chat_id, event_type, data)
+    except SQLAlchemyError as e:
+        dropped = is_overload(e)
+        raise
+    finally:
+        admission.release(priority, started, dropped)
+
+
+async def process_ws_event(
+    websocket: WebSocket,
+    session: AsyncSession,
+    user_id: int,
+    chat_id: int,
+    event_type: str,
+    data: dict,
+) -> None:
+    if event_type == "message":
+        text = data.get("text") or ""
+        logger.info(f"Пользователь {user_id} отправляет сообщение в чат {chat_id}: {text}")
+        attachment = None
+        attachment_id = data.get("attachment_id")
+        if attachment_id is not None:
+            attachment = await get_accessible(session, attachment_id, user_id)
+            if attachment is None:
+                await websocket.send_json(
+                    {
+                        "type": "error",
+                        "code": "attachment_not_found",
+                        "event": event_type,
+                        "chat_id": chat_id,
+                    }
+                )
+                return
+        try:
+            msg = await create_message(session, chat_id, user_id, text, attachment_id)
+        except SequenceConflict:
+            logger.warning(f"WS: конфликт seq в чате {chat_id}, сообщение не записано")
+            await websocket.send_json(
+                {
+                    "type": "error",
+                    "code": "conflict",
+                    "event": event_type,
+                    "chat_id": chat_id,
+                    "retry_after": SEQUENCE_RETRY_AFTER,
+                }
+            )
+            return
+        except MissingReference:
+            await websocket.send_json(
+                {
+                    "type": "error",
+                    "code": "not_found",
+                    "event": event_type,
+                    "chat_id": chat_id,
+                }
+            )
+            return
+        versions.bump_chat(chat_id, msg.seq)
+        replica_router.mark_write(user_id)
+        await deliver(session, msg, attachment)
+        logger.info(f"Сообщение отправлено всем в чате {chat_id}: id {msg.id}")
+    elif event_type == "read":
+        msg_id = data.get("message_id")
+        result = await session.execute(select(Message).filter_by(id=msg_id))
+        msg = result.scalar_one_or_none()
+        if msg and msg.chat_id == chat_id and not msg.is_read:
+            logger.info(f"Пользователь {user_id} отметил сообщение {msg_id} как прочитанное в чате {chat_id}")
+            msg.is_read = True
+            try:
+                await session.commit()
+            except IntegrityError:
+                await session.rollback()
+            payload = {
+                "type": "read",
+                "chat_id": chat_id,
+                "message_id": msg_id,
+                "reader_id": user_id,
+            }
+            await manager.send_personal_message(chat_id, msg.sender_id, payload)
 
 
 @router.websocket("/ws/{chat_id}")
@@ -51,66 +371,112 @@ async def websocket_endpoint(
 ):
     current_user = await get_current_user_ws(token, session)
     logger.info(f"Пользователь {current_user.id} подключился к чату {chat_id} (WS)")
+    delivery_mode = await session.scalar(
+        select(Chat.delivery_mode).where(Chat.id == chat_id)
+    )
+    if delivery_mode:
+        manager.set_delivery_mode(chat_id, delivery_mode)
     await manager.connect(chat_id, websocket, current_user.id)
+    profiled = profiler.requested(websocket.headers.get(PROFILE_HEADER))
     try:
+        await send_catch_up(websocket, current_user.id, [chat_id])
         while True:
             try:
                 data = await websocket.receive_json()
                 logger.debug(f"WS получены данные от пользователя {current_user.id}: {data}")
             except JSONDecodeError:
+                manager.touch(websocket)
                 continue
-            event_type = data.get("type")
-            if event_type == "message":
-                client_msg_id = data.get("client_message_id")
-                text = data.get("text")
-                logger.info(f"Пользователь {current_user.id} отправляет сообщение в чат {chat_id}: {text}")
-                msg = Message(
-                    chat_id=chat_id,
-                    sender_id=current_user.id,
-                    text=text,
-                    timestamp=datetime.utcnow(),
-                    client_message_id=str(uuid.uuid4()),
-                )
-                session.add(msg)
-                try:
-                    await session.commit()
-                except IntegrityError:
-                    await session.rollback()
-                    continue
-                await session.refresh(msg)
-                payload = {
-                    "type": "message",
-                    "id": msg.id,
-                    "chat_id": chat_id,
-                    "sender_id": current_user.id,
-                    "text": text,
-                    "timestamp": msg.timestamp.isoformat(),
-                }
-                await manager.broadcast(chat_id, payload)
-                logger.info(f"Сообщение отправлено всем в чате {chat_id}: id {msg.id}")
-            elif event_type == "read":
-                msg_id = data.get("message_id")
-                result = await session.execute(select(Message).filter_by(id=msg_id))
-                msg = result.scalar_one_or_none()
-                if msg and not msg.is_read:
-                    logger.info(f"Пользователь {current_user.id} отметил сообщение {msg_id} как прочитанное в чате {chat_id}")
-                    msg.is_read = True
-                    try:
-                        await session.commit()
-                    except IntegrityError:
-                        await session.rollback()
-                    payload = {
-                        "type": "read",
-                        "message_id": msg_id,
-                        "reader_id": current_user.id,
-                    }
-                    await manager.send_personal_message(chat_id, msg.sender_id, payload)
+            manager.touch(websocket)
+            if data.get("type") == "pong":
+                continue
+            if data.get("type") == "ack":
+                ack_mailbox(websocket, current_user.id, data)
+                continue
+            async with profiler.profile("ws", f"/ws/{{chat_id}} {data.get('type')}", profiled):
+                await handle_ws_event(websocket, session, current_user.id, chat_id, data)
     except WebSocketDisconnect:
-        manager.disconnect(chat_id, websocket)
         logger.info(f"Пользователь {current_user.id} отключился от чата {chat_id} (WS)")
+    finally:
+        mailbox.mark_seen(current_user.id, [chat_id])
+        await manager.disconnect(chat_id, websocket, current_user.id)
 
 
-@router.post("/chats", response_model=ChatSchema)
+@router.websocket("/ws")
+async def user_websocket_endpoint(
+    websocket: WebSocket,
+    token: str = Query(...),
+    chats: Optional[str] = Query(
+        default=None, description="Подмножество чатов через запятую, по умолчанию все"
+    ),
+):
+    """Одно соединение на пользователя для всех его чатов.
+
+    События от клиента и к клиенту несут chat_id. Сессия БД берется на время
+    обработки одного события, а не держится все время жизни сокета.
+    """
+    async with AsyncSessionLocal() as session:
+        current_user = await get_current_user_ws(token, session)
+        user_id = current_user.id
+        q = (
+            select(chat_users.c.chat_id, Chat.delivery_mode)
+            .join(Chat, Chat.id == chat_users.c.chat_id)
+            .where(chat_users.c.user_id == user_id)
+        )
+        if chats:
+            try:
+                requested = {int(chat_id) for chat_id in chats.split(",") if chat_id}
+            except ValueError:
+                await websocket.close(code=1008)
+                return
+            q = q.where(chat_users.c.chat_id.in_(requested))
+        rows = (await session.execute(q)).all()
+
+    for chat_id, delivery_mode in rows:
+        manager.set_delivery_mode(chat_id, delivery_mode)
+    chat_ids = [chat_id for chat_id, _ in rows]
+    await manager.connect_user(websocket, user_id, chat_ids)
+    logger.info(f"Пользователь {user_id} подключился к {len(rows)} чатам (WS)")
+    profiled = profiler.requested(websocket.headers.get(PROFILE_HEADER))
+    try:
+        await send_catch_up(websocket, user_id, chat_ids, complete=not chats)
+        while True:
+            try:
+                data = await websocket.receive_json()
+                logger.debug(f"WS получены данные от пользователя {user_id}: {data}")
+            except JSONDecodeError:
+                manager.touch(websocket)
+                continue
+            manager.touch(websocket)
+            if data.get("type") == "pong":
+                continue
+            if data.get("type") == "ack":
+                ack_mailbox(websocket, user_id, data)
+                continue
+            chat_id = data.get("chat_id")
+            if not isinstance(chat_id, int) or not manager.is_subscribed(websocket, chat_id):
+                await websocket.send_json(
+                    {
+                        "type": "error",
+                        "code": "not_subscribed",
+                        "event": data.get("type"),
+                        "chat_id": chat_id,
+                    }
+                )
+                continue
+            async with profiler.profile("ws", f"/ws {data.get('type')}", profiled):
+                async with AsyncSessionLocal() as session:
+                    await handle_ws_event(websocket, session, user_id, chat_id, data)
+    except WebSocketDisconnect:
+        logger.info(f"Пользователь {user_id} отключился (WS)")
+    finally:
+        state = manager.connections.get(websocket)
+        if state is not None:
+            mailbox.mark_seen(user_id, state.chats)
+        manager.remove(websocket)
+
+
+@router.post("/chats", response_model=ChatSchema, dependencies=[admitted(SEND)])
 async def create_chat(
     data: ChatCreate,
     session: AsyncSession = Depends(get_async_session),
@@ -144,9 +510,16 @@ async def create_chat(
                 status_code=400,
                 detail="Приватный чат между этими пользователями уже существует",
             )
+        if data.delivery_mode == "pull":
+            raise HTTPException(
+                status_code=400,
+                detail="Режим pull доступен только для групповых чатов",
+            )
     chat = Chat(
         name=data.name,
         chat_type=data.chat_type,
+        delivery_mode=data.delivery_mode,
+        retention_days=data.retention_days,
     )
     session.add(chat)
     await session.flush()
@@ -164,7 +537,15 @@ async def create_chat(
             rows = [{"group_id": group.id, "user_id": uid} for uid in unique_ids]
             await session.execute(insert(group_members), rows)
 
+    await versions.bump_users(session, unique_ids)
     await session.commit()
+    versions.invalidate_users(unique_ids)
+    for uid in unique_ids:
+        replica_router.mark_write(uid)
+    manager.set_delivery_mode(chat.id, data.delivery_mode.value)
+    # Открытые сокеты /ws участников подписываются на новый чат сразу, без
+    # переподключения.
+    await manager.update_members(chat.id, unique_ids, [])
     result = await session.execute(
         select(Chat).options(selectinload(Chat.members)).filter_by(id=chat.id)
     )
@@ -172,30 +553,311 @@ async def create_chat(
     return chat_with_members
 
 
-@router.get("/chats", response_model=List[ChatSchema])
-async def list_chats(
+@router.patch(
+    "/chats/{chat_id}/delivery",
+    response_model=ChatSchema,
+    dependencies=[admitted(SEND)],
+)
+async def update_delivery_mode(
+    chat_id: int,
+    data: ChatDeliveryUpdate,
+    session: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user),
+):
+    logger.info(f"Смена режима доставки чата {chat_id} на {data.delivery_mode} пользователем {current_user.id}")
+    group = await session.scalar(select(Group).where(Group.chat_id == chat_id))
+    if group is None:
+        raise HTTPException(status_code=404, detail="Групповой чат не найден")
+    if group.creator_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Менять режим может только создатель группы")
+
+    chat = await session.get(Chat, chat_id)
+    chat.delivery_mode = data.delivery_mode
+    member_ids = (
+        await session.scalars(
+            select(chat_users.c.user_id).where(chat_users.c.chat_id == chat_id)
+        )
+    ).all()
+    await versions.bump_users(session, member_ids)
+    await session.commit()
+    versions.invalidate_users(member_ids)
+    replica_router.mark_write(current_user.id)
+    manager.set_delivery_mode(chat_id, data.delivery_mode.value)
+    return chat
+
+
+async def get_managed_chat(session: AsyncSession, chat_id: int, user_id: int) -> Chat:
+    """Чат, которым может управлять пользователь: группа - создатель, приватный - участник."""
+    chat = await session.get(Chat, chat_id)
+    if chat is None or chat.deleted_at is not None:
+        raise HTTPException(status_code=404, detail="Чат не найден")
+    if chat.chat_type == "group":
+        creator_id = await session.scalar(
+            select(Group.creator_id).where(Group.chat_id == chat_id)
+        )
+        if creator_id != user_id:
+            raise HTTPException(status_code=403, detail="Управлять группой может только создатель")
+    else:
+        is_member = await session.scalar(
+            select(chat_users.c.user_id).where(
+                chat_users.c.chat_id == chat_id, chat_users.c.user_id == user_id
+            )
+        )
+        if is_member is None:
+            raise HTTPException(status_code=403, detail="Вы не участник этого чата")
+    return chat
+
+
+@router.patch(
+    "/chats/{chat_id}/retention",
+    response_model=ChatSchema,
+    dependencies=[admitted(SEND)],
+)
+async def update_retention(
+    chat_id: int,
+    data: ChatRetentionUpdate,
     session: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user),
+):
+    logger.info(f"Срок хранения чата {chat_id}: {data.retention_days} дн., пользователь {current_user.id}")
+    chat = await get_managed_chat(session, chat_id, current_user.id)
+    chat.retention_days = data.retention_days
+    member_ids = (
+        await session.scalars(
+            select(chat_users.c.user_id).where(chat_users.c.chat_id == chat_id)
+        )
+    ).all()
+    await versions.bump_users(session, member_ids)
+    await session.commit()
+    versions.invalidate_users(member_ids)
+    replica_router.mark_write(current_user.id)
+    return chat
+
+
+@router.patch(
+    "/chats/{chat_id}/members",
+    response_model=ChatMembersResult,
+    dependencies=[admitted(SEND)],
+)
+async def update_members(
+    chat_id: int,
+    data: ChatMembersUpdate,
+    session: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user),
+):
+    """Пакетно добавляет и удаляет участников группы.
+
+    Запись идет одним INSERT ... ON CONFLICT DO NOTHING и одним DELETE по
+    массиву id на таблицу, без загрузки состава группы, а подписки живых
+    сокетов затронутых пользователей обновляются сразу после коммита.
+    """
+    logger.info(
+        f"Изменение состава группы {chat_id} пользователем {current_user.id}: "
+        f"+{len(data.add)} -{len(data.remove)}"
+    )
+    group = (
+        await session.execute(
+            select(Group.id, Group.creator_id)
+            .join(Chat, Chat.id == Group.chat_id)
+            .where(Group.chat_id == chat_id, Chat.deleted_at.is_(None))
+        )
+    ).one_or_none()
+    if group is None:
+        raise HTTPException(status_code=404, detail="Групповой чат не найден")
+    if group.creator_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Менять состав может только создатель группы")
+    to_add, to_remove = set(data.add), set(data.remove)
+    if to_add & to_remove:
+        raise HTTPException(status_code=400, detail="Один пользователь в add и remove")
+    if current_user.id in to_remove:
+        raise HTTPException(status_code=400, detail="Создателя нельзя удалить из группы")
+
+    added = await add_members(session, chat_id, group.id, sorted(to_add))
+    removed = await remove_members(session, chat_id, group.id, sorted(to_remove))
+    await versions.bump_users(session, added + removed)
+    await session.commit()
+
+    affected = added + removed
+    versions.invalidate_users(affected)
+    for uid in affected:
+        replica_router.mark_write(uid)
+    mailbox.forget_members([chat_id])
+    await manager.update_members(chat_id, added, removed)
+    logger.info(f"Состав группы {chat_id}: добавлено {len(added)}, удалено {len(removed)}")
+    return {"chat_id": chat_id, "added": added, "removed": removed}
+
+
+@router.delete("/chats/{chat_id}", status_code=204, dependencies=[admitted(SEND)])
+async def delete_chat(
+    chat_id: int,
+    session: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user),
+):
+    """Помечает чат удаленным и сразу убирает участников.
+
+    Сообщения, группа и сама строка чата удаляются в фоне пачками
+    (RetentionPurger), без загрузки всех сообщений через ORM.
+    """
+    logger.info(f"Удаление чата {chat_id} пользователем {current_user.id}")
+    chat = await get_managed_chat(session, chat_id, current_user.id)
+    member_ids = (
+        await session.scalars(
+            select(chat_users.c.user_id).where(chat_users.c.chat_id == chat_id)
+        )
+    ).all()
+    chat.deleted_at = datetime.utcnow()
+    await session.execute(delete(chat_users).where(chat_users.c.chat_id == chat_id))
+    await versions.bump_users(session, member_ids)
+    await session.commit()
+    versions.invalidate_users(member_ids)
+    for uid in member_ids:
+        replica_router.mark_write(uid)
+    sequencer.forget(chat_id)
+    mailbox.forget_members([chat_id])
+    await manager.close_chat(chat_id)
+    purger.wake()
+    return Response(status_code=204)
+
+
+@router.get("/chats", response_model=List[ChatSchema], dependencies=[admitted(READ)])
+async def list_chats(
+    if_none_match: Optional[str] = Header(default=None),
+    session: AsyncSession = Depends(get_read_session),
     current_user=Depends(get_current_user),
 ):
     logger.info(f"Запрос списка чатов для пользователя {current_user.id}")
-    q = select(Chat).join(chat_users).filter(chat_users.c.user_id == current_user.id)
+    version = await versions.user_chats_version(
+        session, current_user.id, cached=not is_replica_session(session)
+    )
+    etag = f'"chats-{current_user.id}-{version}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    q = (
+        select(*CHAT_COLUMNS)
+        .join(chat_users)
+        .filter(chat_users.c.user_id == current_user.id)
+    )
     result = await session.execute(q)
-    return result.scalars().all()
+    return ORJSONResponse(rows_to_dicts(result), headers=headers)
 
 
-@router.get("/chats/{chat_id}/messages", response_model=List[MessageSchema])
+@router.get(
+    "/chats/{chat_id}/messages",
+    response_model=List[MessageSchema],
+    dependencies=[admitted(READ)],
+)
 async def get_history(
     chat_id: int,
-    session: AsyncSession = Depends(get_async_session),
+    session: AsyncSession = Depends(get_read_session),
     current_user=Depends(get_current_user),
 ):
     logger.info(f"Получение истории чата {chat_id} пользователем {current_user.id}")
-    q = select(Message).filter_by(chat_id=chat_id).order_by(Message.timestamp)
+    q = (
+        select(*MESSAGE_COLUMNS)
+        .filter(Message.chat_id == chat_id)
+        .order_by(Message.seq)
+    )
     result = await session.execute(q)
-    return result.scalars().all()
+    return ORJSONResponse(rows_to_dicts(result))
+
+
+@router.get("/chats/{chat_id}/messages/export")
+async def export_history(
+    chat_id: int,
+    gzip: bool = Query(default=False, description="Сжать выгрузку gzip"),
+    session: AsyncSession = Depends(get_read_session),
+    current_user: User = Depends(get_current_user),
+):
+    logger.info(f"HTTP: экспорт истории чата {chat_id} пользователем {current_user.id}, gzip={gzip}")
+    chat_member = await session.execute(
+        select(chat_users).where(
+            chat_users.c.chat_id == chat_id, chat_users.c.user_id == current_user.id
+        )
+    )
+    if not chat_member.first():
+        raise HTTPException(status_code=403, detail="У вас нет доступа к этому чату")
+
+    headers = {"Content-Disposition": f'attachment; filename="chat-{chat_id}.ndjson"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    sessionmaker = await get_read_sessionmaker(current_user.id)
+    # Место занимается на все время отдачи тела, а не только обработчика.
+    body = AdmittedStream(
+        iter_history_ndjson(chat_id, compress=gzip, sessionmaker=sessionmaker),
+        READ,
+        admit(READ),
+    )
+    return StreamingResponse(
+        body, media_type="application/x-ndjson", headers=headers
+    )
+
+
+@router.get(
+    "/chats/{chat_id}/batches/{after_seq}",
+    response_model=List[MessageSchema],
+    dependencies=[admitted(READ)],
+)
+async def get_message_batch(
+    chat_id: int,
+    after_seq: int,
+    limit: int = Query(default=100, ge=1, le=500, description="Размер пачки"),
+    if_none_match: Optional[str] = Header(default=None),
+    session: AsyncSession = Depends(get_read_session),
+    current_user: User = Depends(get_current_user),
+):
+    """Пачка сообщений с seq в (after_seq, after_seq + limit].
+
+    Клиенты чатов в режиме pull забирают тела этим запросом после уведомления
+    new_messages. Новые сообщения в полную пачку не попадают: seq выдаются без
+    пропусков. Убрать из нее сообщения может только очистка, поэтому полная
+    пачка кешируется на BATCH_MAX_AGE секунд, а в чатах со сроком хранения не
+    кешируется без проверки ETag.
+    """
+    chat = (
+        await session.execute(
+            select(Chat.retention_days)
+            .join(chat_users, chat_users.c.chat_id == Chat.id)
+            .where(Chat.id == chat_id, chat_users.c.user_id == current_user.id)
+        )
+    ).first()
+    if chat is None:
+        raise HTTPException(status_code=403, detail="У вас нет доступа к этому чату")
+
+    result = await session.execute(
+        select(*MESSAGE_COLUMNS)
+        .filter(
+            Message.chat_id == chat_id,
+            Message.seq > after_seq,
+            Message.seq <= after_seq + limit,
+        )
+        .order_by(Message.seq)
+    )
+    rows = rows_to_dicts(result)
+    # Маркер и полнота считаются по отданным строкам, а не по версии чата:
+    # реплика может отставать, а часть сообщений - быть удалена. Очистка
+    # только убирает строки диапазона, поэтому меняет и их число в маркере.
+    # seq уникален в чате, поэтому limit строк с последним seq = after_seq +
+    # limit - это весь диапазон без пропусков.
+    upper = rows[-1]["seq"] if rows else after_seq
+    etag = f'"batch-{chat_id}-{after_seq}-{upper}-{len(rows)}"'
+    expires = chat.retention_days is not None or purger.global_days is not None
+    if len(rows) == limit and upper == after_seq + limit and not expires:
+        cache_control = f"private, max-age={BATCH_MAX_AGE}"
+    else:
+        cache_control = "private, no-cache"
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return ORJSONResponse(rows, headers=headers)
 
 
-@router.post("/chats/{chat_id}/messages", response_model=MessageSchema)
+@router.post(
+    "/chats/{chat_id}/messages",
+    response_model=MessageSchema,
+    dependencies=[admitted(SEND)],
+)
 async def send_message_http(
     chat_id: int,
     data: MessageCreate,
@@ -203,27 +865,53 @@ async def send_message_http(
     current_user=Depends(get_current_user),
 ):
     logger.info(f"HTTP: отправка сообщения пользователем {current_user.id} в чат {chat_id}: {data.text}")
-    msg = Message(
-        chat_id=chat_id,
-        sender_id=current_user.id,
-        text=data.text,
-        timestamp=datetime.utcnow(),
-        client_message_id=str(uuid.uuid4()),
-    )
-    session.add(msg)
-    await session.commit()
-    await session.refresh(msg)
+    retry_after = rate_limiter.acquire(current_user.id, chat_id)
+    if retry_after:
+        logger.warning(f"HTTP: превышен лимит для пользователя {current_user.id} в чате {chat_id}")
+        raise HTTPException(
+            status_code=429,
+            detail="Слишком много сообщений, попробуйте позже",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+    attachment = None
+    if data.attachment_id is not None:
+        attachment = await get_accessible(session, data.attachment_id, current_user.id)
+        if attachment is None:
+            raise HTTPException(status_code=404, detail="Вложение не найдено")
+    try:
+        msg = await create_message(
+            session, chat_id, current_user.id, data.text, data.attachment_id
+        )
+    except SequenceConflict:
+        raise HTTPException(
+            status_code=409,
+            detail="Конфликт записи в чат, повторите отправку",
+            headers={"Retry-After": str(SEQUENCE_RETRY_AFTER)},
+        )
+    except MissingReference:
+        raise HTTPException(status_code=404, detail="Чат или вложение не найдены")
+    versions.bump_chat(chat_id, msg.seq)
+    replica_router.mark_write(current_user.id)
+    await deliver(session, msg, attachment)
     return msg
 
 
-@router.get("/history/{chat_id}", response_model=MessageHistoryResponse)
+@router.get(
+    "/history/{chat_id}",
+    response_model=MessageHistoryResponse,
+    dependencies=[admitted(READ)],
+)
 async def get_message_history(
     chat_id: int,
     limit: int = Query(
         default=50, ge=1, le=100, description="Количество сообщений на странице"
     ),
     offset: int = Query(default=0, ge=0, description="Смещение от начала"),
-    session: AsyncSession = Depends(get_async_session),
+    after_seq: Optional[int] = Query(
+        default=None, ge=0, description="Вернуть сообщения с seq больше указанного"
+    ),
+    if_none_match: Optional[str] = Header(default=None),
+    session: AsyncSession = Depends(get_read_session),
     current_user: User = Depends(get_current_user),
 ):
     logger.info(f"HTTP: получение истории сообщений чата {chat_id}, смещение={offset}, лимит={limit}, пользователь={current_user.id}")
@@ -235,19 +923,32 @@ async def get_message_history(
     if not chat_member.first():
         raise HTTPException(status_code=403, detail="У вас нет доступа к этому чату")
 
+    version = await versions.chat_version(
+        session, chat_id, cached=not is_replica_session(session)
+    )
+    etag = f'"history-{chat_id}-{version}-{after_seq}-{offset}-{limit}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
     total_count = await session.execute(
         select(func.count(Message.id)).filter(Message.chat_id == chat_id)
     )
     total = total_count.scalar()
 
+    q = select(*MESSAGE_COLUMNS).filter(Message.chat_id == chat_id)
+    if after_seq is not None:
+        q = q.filter(Message.seq > after_seq)
     messages = await session.execute(
-        select(Message)
-        .filter(Message.chat_id == chat_id)
-        .order_by(Message.timestamp.asc())
-        .offset(offset)
-        .limit(limit)
+        q.order_by(Message.seq.asc()).offset(offset).limit(limit)
     )
 
-    return MessageHistoryResponse(
-        items=messages.scalars().all(), total=total, offset=offset, limit=limit
+    return ORJSONResponse(
+        {
+            "items": rows_to_dicts(messages),
+            "total": total,
+            "offset": offset,
+            "limit": limit,
+        },
+        headers=headers,
     )
@@ -0,0 +1,70 @@
+import os
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.dependencies import get_read_session
+from app.models.tables import User
+from app.schemas.tables import UserSearchResponse
+from app.service.admission import READ
+from app.service.directory import InvalidCursor, SearchCache, search_fuzzy, search_prefix
+from app.utils.jwt import get_current_user
+
+from .chat import admitted
+
+import logging
+
+logger = logging.getLogger("users")
+
+router = APIRouter(tags=["users"])
+
+search_cache = SearchCache(
+    max_items=int(os.getenv("USER_SEARCH_CACHE_ITEMS", 10_000)),
+    ttl=float(os.getenv("USER_SEARCH_CACHE_TTL", 30)),
+)
+# Нечеткий поиск по одной-двум буквам совпадает почти со всеми и индексом
+# триграмм не сужается.
+FUZZY_MIN_LENGTH = 3
+
+
+@router.get(
+    "/users/search",
+    response_model=UserSearchResponse,
+    dependencies=[admitted(READ)],
+)
+async def search_users(
+    q: str = Query(..., min_length=1, max_length=100, description="Начало имени или email"),
+    fuzzy: bool = Query(default=False, description="Нечеткий поиск по триграммам"),
+    limit: int = Query(default=20, ge=1, le=100),
+    cursor: Optional[str] = Query(default=None, description="next_cursor предыдущей страницы"),
+    session: AsyncSession = Depends(get_read_session),
+    current_user: User = Depends(get_current_user),
+):
+    """Поиск пользователей для начала чата: по префиксу имени (или email, если в
+    запросе есть @) либо нечеткий. Страницы - по курсору, без offset."""
+    query = q.strip()
+    if not query:
+        raise HTTPException(status_code=422, detail="Пустой запрос")
+    if fuzzy and len(query) < FUZZY_MIN_LENGTH:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Для нечеткого поиска нужно не меньше {FUZZY_MIN_LENGTH} символов",
+        )
+    cache_key = (fuzzy, query.lower(), limit)
+    if cursor is None:
+        page = search_cache.get(cache_key)
+        if page is not None:
+            return ORJSONResponse(page)
+
+    search = search_fuzzy if fuzzy else search_prefix
+    try:
+        items, next_cursor = await search(session, query, limit, cursor)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+    page = {"items": items, "next_cursor": next_cursor}
+    if cursor is None:
+        search_cache.put(cache_key, page)
+    logger.debug(f"Поиск пользователей '{query}' (fuzzy={fuzzy}): {len(items)}")
+    return ORJSONResponse(page)
@@ -10,6 +10,11 @@ class ChatType(str, Enum):
     GROUP = "group"
 
 
+class DeliveryMode(str, Enum):
+    PUSH = "push"
+    PULL = "pull"
+
+
 class UserEmail(BaseModel):
     email: EmailStr
 
@@ -33,15 +38,46 @@ class User(UserBase):
         from_attributes = True
 
 
+class UserPublic(BaseModel):
+    id: int
+    name: Optional[str] = None
+
+
+class UserSearchResponse(BaseModel):
+    items: List[UserPublic]
+    next_cursor: Optional[str] = None
+
+
 class ChatBase(BaseModel):
     name: str = Field(None, min_length=1, max_length=50)
     chat_type: ChatType = Field(default=ChatType.PRIVATE)
+    delivery_mode: DeliveryMode = Field(default=DeliveryMode.PUSH)
+    retention_days: Optional[int] = Field(default=None, ge=1)
 
 
 class ChatCreate(ChatBase):
     member_ids: List[int]
 
 
+class ChatDeliveryUpdate(BaseModel):
+    delivery_mode: DeliveryMode
+
+
+class ChatRetentionUpdate(BaseModel):
+    retention_days: Optional[int] = Field(default=None, ge=1)
+
+
+class ChatMembersUpdate(BaseModel):
+    add: List[int] = Field(default_factory=list, max_length=10000)
+    remove: List[int] = Field(default_factory=list, max_length=10000)
+
+
+class ChatMembersResult(BaseModel):
+    chat_id: int
+    added: List[int]
+    removed: List[int]
+
+
 class Chat(ChatBase):
     id: int
 
@@ -70,11 +106,13 @@ class MessageBase(BaseModel):
     text: str
     chat_id: int
     client_message_id: Optional[str] = None
+    attachment_id: Optional[int] = None
 
 
 class MessageCreate(BaseModel):
-    text: str
+    text: str = ""
     client_message_id: Optional[str] = None
+    attachment_id: Optional[int] = None
 
     class Config:
         schema_extra = {
@@ -88,12 +126,22 @@ class MessageCreate(BaseModel):
 class Message(MessageBase):
     id: int
     sender_id: int
+    seq: int
     created_at: datetime
 
     class Config:
         from_attributes = True
 
 
+class Attachment(BaseModel):
+    id: int
+    filename: str
+    content_type: str
+    size: int
+    sha256: str
+    url: str
+
+
 class MessageHistoryResponse(BaseModel):
     items: List[Message]
     total: int
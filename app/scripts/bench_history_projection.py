@@ -0,0 +1,123 @@
+import argparse
+import json
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import List
+
+import orjson
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from app.db import Base
+from app.models.projections import MESSAGE_COLUMNS, rows_to_dicts
+from app.models.tables import Chat, Message, User
+from app.schemas.tables import Message as MessageSchema
+
+# Сравнение двух путей чтения страницы истории:
+#   orm        - select(Message) -> ORM-объекты -> from_attributes-валидация
+#                -> json (как FastAPI с response_model);
+#   projection - select(*MESSAGE_COLUMNS) -> dict -> orjson (ORJSONResponse).
+# База - SQLite в памяти, чтобы замер не зависел от сети и Postgres:
+# сравнивается только CPU и аллокации на стороне приложения.
+#
+#   python -m app.scripts.bench_history_projection --rows 100 --iterations 2000
+
+messages_adapter = TypeAdapter(List[MessageSchema])
+
+
+def seed(engine, rows: int) -> None:
+    Base.metadata.create_all(engine)
+    now = datetime.utcnow()
+    with Session(engine) as session:
+        session.add(User(id=1, name="bench", email="bench@example.com", password="x"))
+        session.add(Chat(id=1, name="bench", chat_type="private"))
+        session.add_all(
+            Message(
+                chat_id=1,
+                sender_id=1,
+                seq=i + 1,
+                text=f"Сообщение номер {i} для замера",
+                timestamp=now + timedelta(seconds=i),
+                created_at=now + timedelta(seconds=i),
+                client_message_id=f"bench-{i}",
+            )
+            for i in range(rows)
+        )
+        session.commit()
+
+
+def orm_page(engine, rows: int) -> bytes:
+    with Session(engine) as session:
+        result = session.execute(
+            select(Message).filter(Message.chat_id == 1).order_by(Message.seq).limit(rows)
+        )
+        items = messages_adapter.validate_python(result.scalars().all(), from_attributes=True)
+        return json.dumps(messages_adapter.dump_python(items, mode="json")).encode()
+
+
+def projection_page(engine, rows: int) -> bytes:
+    with Session(engine) as session:
+        result = session.execute(
+            select(*MESSAGE_COLUMNS)
+            .filter(Message.chat_id == 1)
+            .order_by(Message.seq)
+            .limit(rows)
+        )
+        return orjson.dumps(rows_to_dicts(result))
+
+
+def measure(name, fn, engine, rows: int, iterations: int) -> dict:
+    for _ in range(min(iterations, 50)):
+        fn(engine, rows)
+
+    started = time.process_time()
+    for _ in range(iterations):
+        fn(engine, rows)
+    cpu = time.process_time() - started
+
+    tracemalloc.start()
+    fn(engine, rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "name": name,
+        "cpu_us_per_row": cpu / iterations / rows * 1e6,
+        "peak_kib": peak / 1024,
+        "peak_bytes_per_row": peak / rows,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк страницы истории: ORM против проекции")
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    seed(engine, args.rows)
+    assert orjson.loads(orm_page(engine, args.rows)) == orjson.loads(
+        projection_page(engine, args.rows)
+    ), "пути чтения отдают разные данные"
+
+    results = [
+        measure("orm", orm_page, engine, args.rows, args.iterations),
+        measure("projection", projection_page, engine, args.rows, args.iterations),
+    ]
+    print(f"{'путь':<12}{'CPU мкс/строка':>16}{'пик KiB':>12}{'пик байт/строка':>18}")
+    for r in results:
+        print(
+            f"{r['name']:<12}{r['cpu_us_per_row']:>16.2f}"
+            f"{r['peak_kib']:>12.1f}{r['peak_bytes_per_row']:>18.0f}"
+        )
+    orm, projection = results
+    print(
+        f"Экономия CPU: {1 - projection['cpu_us_per_row'] / orm['cpu_us_per_row']:.0%}, "
+        f"пиковой памяти: {1 - projection['peak_kib'] / orm['peak_kib']:.0%}"
+    )
+
+
+if __name__ == "__main__":
+    main()
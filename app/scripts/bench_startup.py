@@ -0,0 +1,118 @@
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+# Замер старта приложения:
+#   import     - время `import app.main` и `create_app()` в новом интерпретаторе;
+#   ttfr       - от запуска uvicorn до первого успешного ответа /health
+#                (включает lifespan: движок, прогрев пула, кеши);
+#   first/next - время первого и второго запроса к --path после старта,
+#                с прогревом пула (DB_POOL_WARM) и без него.
+# Для ttfr нужна доступная база, как и для обычного запуска.
+#
+#   python -m app.scripts.bench_startup --runs 5 --path /chats --token $TOKEN
+
+IMPORT_SNIPPET = (
+    "import time\n"
+    "t = time.perf_counter()\n"
+    "import app.main\n"
+    "t_import = time.perf_counter() - t\n"
+    "t = time.perf_counter()\n"
+    "app.main.create_app()\n"
+    "print(t_import, time.perf_counter() - t)\n"
+)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_import(runs: int) -> dict:
+    imports, factories = [], []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", IMPORT_SNIPPET],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.split()
+        imports.append(float(out[-2]))
+        factories.append(float(out[-1]))
+    return {
+        "import_ms": statistics.median(imports) * 1000,
+        "create_app_ms": statistics.median(factories) * 1000,
+    }
+
+
+def request(url: str, headers: dict) -> float:
+    started = time.perf_counter()
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=10) as r:
+        r.read()
+    return time.perf_counter() - started
+
+
+def measure_ttfr(args, warm: int) -> dict:
+    port = free_port()
+    env = {**os.environ, "DB_POOL_WARM": str(warm)}
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "app.main:create_app", "--factory",
+            "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning",
+        ],
+        env=env,
+    )
+    base = f"http://127.0.0.1:{port}"
+    try:
+        while True:
+            if server.poll() is not None:
+                raise SystemExit("uvicorn завершился при старте")
+            try:
+                request(base + "/health", {})
+                break
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.005)
+        ttfr = time.perf_counter() - started
+        headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+        first = request(base + args.path, headers)
+        second = request(base + args.path, headers)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return {"ttfr_ms": ttfr * 1000, "first_ms": first * 1000, "next_ms": second * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер импорта и времени до первого запроса")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/health", help="Запрос после старта, например /chats")
+    parser.add_argument("--token", default=None, help="JWT для --path")
+    parser.add_argument("--warm", type=int, default=int(os.getenv("DB_POOL_WARM", 2)))
+    parser.add_argument("--skip-server", action="store_true", help="Только замер импорта")
+    args = parser.parse_args()
+
+    result = measure_import(args.runs)
+    print(f"import app.main: {result['import_ms']:.1f} мс, create_app(): {result['create_app_ms']:.1f} мс")
+    if args.skip_server:
+        return
+
+    for warm in (0, args.warm):
+        runs = [measure_ttfr(args, warm) for _ in range(args.runs)]
+        print(
+            f"DB_POOL_WARM={warm}: "
+            f"ttfr {statistics.median(r['ttfr_ms'] for r in runs):.1f} мс, "
+            f"первый {args.path} {statistics.median(r['first_ms'] for r in runs):.1f} мс, "
+            f"следующий {statistics.median(r['next_ms'] for r in runs):.1f} мс"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import uuid
+from typing import Dict, List, Tuple
+
+import asyncpg
+import greenlet
+from sqlalchemy import event
+from starlette.testclient import TestClient
+
+from app import db
+from app.scripts.generate_load_data import ASYNCPG_DSN
+
+import logging
+
+logger = logging.getLogger("check_query_plans")
+
+# Регрессионная проверка планов запросов.
+#
+# 1. (необязательно) заливает большой набор данных генератором generate_load_data;
+# 2. прогоняет HTTP- и WebSocket-эндпоинты приложения и перехватывает каждый
+#    SQL-запрос, который они отправляют через движок app.db;
+# 3. для каждого уникального запроса выполняет EXPLAIN (ANALYZE, BUFFERS) с теми же
+#    параметрами внутри транзакции, которая затем откатывается;
+# 4. падает, если в плане есть Seq Scan по большой таблице или превышены
+#    бюджеты по буферам или времени.
+#
+#   python -m app.scripts.check_query_plans --seed --users 200000 --chats 400000
+#
+# Запускать на отдельной базе: прогон создает пользователей, чаты и сообщения.
+
+SQL_PREFIXES = ("select", "insert", "update", "delete", "with")
+
+
+class StatementRecorder:
+    """Собирает запросы движка вместе с местом в коде, откуда они пришли."""
+
+    def __init__(self):
+        self.statements: Dict[str, Tuple[str, tuple]] = {}
+
+    @staticmethod
+    def _frames():
+        # Под AsyncSession событие приходит из гринлета SQLAlchemy, и цепочка
+        # f_back обрывается на его границе. Код приложения ждет в корутине
+        # задачи, приостановленной в родительском гринлете (greenlet_spawn),
+        # поэтому сначала обходятся его кадры, затем стек текущей задачи и
+        # обычный стек - для синхронных вызовов.
+        try:
+            parent = greenlet.getcurrent().parent
+        except Exception:
+            parent = None
+        while parent is not None:
+            frame = parent.gr_frame
+            while frame is not None:
+                yield frame
+                frame = frame.f_back
+            parent = parent.parent
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is not None:
+            yield from reversed(task.get_stack(limit=None))
+        frame = sys._getframe(2)
+        while frame is not None:
+            yield frame
+            frame = frame.f_back
+
+    @classmethod
+    def _origin(cls) -> str:
+        for frame in cls._frames():
+            filename = frame.f_code.co_filename.replace(os.sep, "/")
+            if "/app/" in filename and "/app/scripts/" not in filename:
+                path = filename.split("/app/", 1)[1]
+                return f"app/{path}:{frame.f_code.co_name}"
+        return "?"
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if not statement.lstrip().lower().startswith(SQL_PREFIXES):
+            return
+        if executemany and parameters:
+            parameters = parameters[0]
+        if statement not in self.statements:
+            self.statements[statement] = (self._origin(), tuple(parameters or ()))
+
+
+def drive_app(args, recorder: StatementRecorder) -> None:
+    """Проходит по всем эндпоинтам так же, как это делает клиент."""
+    from app.main import create_app
+    from app.service.retention import purger
+
+    with TestClient(create_app()) as client:
+        # Движок создается в lifespan, поэтому запросы перехватываются только
+        # после старта приложения.
+        event.listen(db.engine.sync_engine, "before_cursor_execute", recorder.before_cursor_execute)
+        try:
+            exercise(client, args)
+            # Удаленный чат и сообщения с истекшим сроком убирает фоновый проход.
+            client.portal.call(purger.run_once)
+        finally:
+            event.remove(
+                db.engine.sync_engine, "before_cursor_execute", recorder.before_cursor_execute
+            )
+
+
+def exercise(client: TestClient, args) -> None:
+    email = f"plan-{uuid.uuid4().hex[:12]}@load.test"
+    password = "password123"
+    response = client.post(
+        "/register", json={"email": email, "password": password, "name": "План"}
+    )
+    response.raise_for_status()
+    me_id = response.json()["id"]
+
+    response = client.post("/login", json={"email": args.email, "password": password})
+    response.raise_for_status()
+    token = response.json()["access_token"]
+    auth = {"Authorization": f"Bearer {token}"}
+    client.get("/me", headers=auth).raise_for_status()
+
+    response = client.get("/chats", headers=auth)
+    response.raise_for_status()
+    chats = response.json()
+    if not chats:
+        raise SystemExit(f"У пользователя {args.email} нет чатов, нужен засеянный набор данных")
+    chat_id = args.chat_id or chats[0]["id"]
+
+    client.get("/users/search", headers=auth, params={"q": "по"}).raise_for_status()
+    response = client.get("/users/search", headers=auth, params={"q": "Пользователь 1", "limit": 5})
+    response.raise_for_status()
+    if response.json()["next_cursor"]:
+        client.get(
+            "/users/search",
+            headers=auth,
+            params={
+                "q": "Пользователь 1",
+                "limit": 5,
+                "cursor": response.json()["next_cursor"],
+            },
+        ).raise_for_status()
+    client.get("/users/search", headers=auth, params={"q": "user1@load"}).raise_for_status()
+    client.get(
+        "/users/search", headers=auth, params={"q": "Пользоватль", "fuzzy": True}
+    ).raise_for_status()
+
+    etag = client.get("/chats", headers=auth).headers.get("ETag")
+    client.get("/chats", headers={**auth, "If-None-Match": etag or ""})
+
+    client.post(
+        "/chats",
+        headers=auth,
+        json={"name": "План", "chat_type": "private", "member_ids": [me_id]},
+    )
+    client.post(
+        "/chats",
+        headers=auth,
+        json={"name": "План", "chat_type": "private", "member_ids": [me_id]},
+    )
+    response = client.post(
+        "/chats",
+        headers=auth,
+        json={"name": "План-группа", "chat_type": "group", "member_ids": [me_id]},
+    )
+    response.raise_for_status()
+    group_chat_id = response.json()["id"]
+    client.patch(
+        f"/chats/{group_chat_id}/delivery", headers=auth, json={"delivery_mode": "pull"}
+    ).raise_for_status()
+    client.patch(
+        f"/chats/{group_chat_id}/retention", headers=auth, json={"retention_days": 30}
+    ).raise_for_status()
+    client.patch(
+        f"/chats/{group_chat_id}/members", headers=auth, json={"add": [me_id, me_id + 1]}
+    ).raise_for_status()
+    client.patch(
+        f"/chats/{group_chat_id}/members", headers=auth, json={"remove": [me_id]}
+    ).raise_for_status()
+
+    client.post(
+        f"/chats/{chat_id}/messages", headers=auth, json={"text": "проверка плана"}
+    ).raise_for_status()
+    client.get(f"/chats/{chat_id}/messages", headers=auth).raise_for_status()
+    client.get(f"/history/{chat_id}?limit=50&offset=0", headers=auth).raise_for_status()
+    client.get(f"/history/{chat_id}?limit=50&after_seq=1", headers=auth).raise_for_status()
+    client.get(f"/chats/{chat_id}/batches/0?limit=100", headers=auth).raise_for_status()
+    with client.stream("GET", f"/chats/{chat_id}/messages/export", headers=auth) as response:
+        for _ in response.iter_bytes():
+            break
+
+    with client.websocket_connect(f"/ws/{chat_id}?token={token}") as websocket:
+        websocket.send_json({"type": "message", "text": "проверка плана (WS)"})
+        message = websocket.receive_json()
+        while message.get("type") != "message":
+            message = websocket.receive_json()
+        websocket.send_json({"type": "read", "message_id": message["id"]})
+        # События обрабатываются по порядку: ответ на это сообщение значит,
+        # что read уже выполнен.
+        websocket.send_json({"type": "message", "text": "проверка плана (WS) 2"})
+        message = websocket.receive_json()
+        while message.get("type") != "message":
+            message = websocket.receive_json()
+
+    with client.websocket_connect(f"/ws?token={token}&chats={chat_id}") as websocket:
+        websocket.send_json({"type": "message", "chat_id": chat_id, "text": "проверка плана (/ws)"})
+        message = websocket.receive_json()
+        while message.get("type") != "message":
+            message = websocket.receive_json()
+        websocket.send_json({"type": "read", "chat_id": chat_id, "message_id": message["id"]})
+        websocket.send_json({"type": "message", "chat_id": chat_id, "text": "проверка плана (/ws) 2"})
+        message = websocket.receive_json()
+        while message.get("type") != "message":
+            message = websocket.receive_json()
+
+    response = client.post(
+        "/attachments?filename=plan.txt", headers=auth, content=b"plan check attachment"
+    )
+    response.raise_for_status()
+    attachment_id = response.json()["id"]
+    client.post(
+        f"/chats/{chat_id}/messages", headers=auth, json={"attachment_id": attachment_id}
+    ).raise_for_status()
+    client.get(f"/attachments/{attachment_id}", headers=auth).raise_for_status()
+
+    client.delete(f"/chats/{group_chat_id}", headers=auth).raise_for_status()
+
+
+def walk(plan: dict):
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from walk(child)
+
+
+async def explain_all(statements, args) -> List[dict]:
+    conn = await asyncpg.connect(ASYNCPG_DSN)
+    try:
+        sizes = {
+            row["relname"]: row["reltuples"]
+            for row in await conn.fetch(
+                "SELECT relname, reltuples FROM pg_class WHERE relkind = 'r' "
+                "AND relnamespace = 'public'::regnamespace"
+            )
+        }
+        report = []
+        for statement, (origin, parameters) in statements.items():
+            # Повтор INSERT с теми же параметрами может упереться в уникальный
+            # индекс; тогда план смотрится без ANALYZE, а бюджеты не проверяются.
+            analyzed = True
+            raw, error = None, None
+            for options in ("ANALYZE, BUFFERS, FORMAT JSON", "FORMAT JSON"):
+                tr = conn.transaction()
+                await tr.start()
+                try:
+                    raw = await conn.fetchval(f"EXPLAIN ({options}) {statement}", *parameters)
+                    break
+                except asyncpg.PostgresError as e:
+                    analyzed, error = False, e
+                finally:
+                    await tr.rollback()
+            if raw is None:
+                report.append(
+                    {
+                        "origin": origin,
+                        "statement": " ".join(statement.split()),
+                        "buffers": 0,
+                        "ms": 0.0,
+                        "analyzed": False,
+                        "problems": [f"EXPLAIN не выполнился: {error!r}"],
+                    }
+                )
+                continue
+            result = json.loads(raw)[0]
+            plan = result["Plan"]
+            problems = []
+            for node in walk(plan):
+                relation = node.get("Relation Name")
+                if node["Node Type"] == "Seq Scan" and sizes.get(relation, 0) >= args.big_table_rows:
+                    problems.append(f"Seq Scan по {relation} (~{sizes[relation]:.0f} строк)")
+            buffers = plan.get("Shared Hit Blocks", 0) + plan.get("Shared Read Blocks", 0)
+            if analyzed and buffers > args.max_buffers:
+                problems.append(f"буферов {buffers} > {args.max_buffers}")
+            elapsed = result.get("Execution Time", 0.0)
+            if analyzed and elapsed > args.max_ms:
+                problems.append(f"{elapsed:.1f} мс > {args.max_ms} мс")
+            report.append(
+                {
+                    "origin": origin,
+                    "statement": " ".join(statement.split()),
+                    "buffers": buffers,
+                    "ms": elapsed,
+                    "analyzed": analyzed,
+                    "problems": problems,
+                }
+            )
+        return report
+    finally:
+        await conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Регрессионная проверка планов запросов")
+    parser.add_argument("--seed", action="store_true", help="Сначала залить данные генератором")
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--chats", type=int, default=400_000)
+    parser.add_argument("--messages-per-chat", type=int, default=50)
+    parser.add_argument("--email", default=None, help="Пользователь для прогона (пароль password123)")
+    parser.add_argument("--chat-id", type=int, default=None)
+    parser.add_argument("--big-table-rows", type=float, default=10_000)
+    parser.add_argument("--max-buffers", type=int, default=1_000)
+    parser.add_argument("--max-ms", type=float, default=50.0)
+    args = parser.parse_args()
+
+    if args.seed:
+        from app.scripts import generate_load_data
+
+        seed_args = generate_load_data.parse_args(
+            [
+                "--users", str(args.users),
+                "--chats", str(args.chats),
+                "--messages-per-chat", str(args.messages_per_chat),
+            ]
+        )
+        asyncio.run(generate_load_data.generate(seed_args))
+
+    if args.email is None:
+        args.email = asyncio.run(pick_user())
+
+    recorder = StatementRecorder()
+    drive_app(args, recorder)
+
+    report = asyncio.run(explain_all(recorder.statements, args))
+    failed = 0
+    for item in sorted(report, key=lambda r: r["origin"]):
+        status = "FAIL" if item["problems"] else "ok"
+        failed += bool(item["problems"])
+        if item["analyzed"]:
+            stats = f"{item['ms']:.2f} мс, буферов {item['buffers']}"
+        else:
+            stats = "без ANALYZE"
+        print(f"[{status:>4}] {item['origin']}  {stats}")
+        print(f"       {item['statement'][:200]}")
+        for problem in item["problems"]:
+            print(f"       ! {problem}")
+    print(f"Запросов: {len(report)}, с проблемами: {failed}")
+    sys.exit(1 if failed else 0)
+
+
+async def pick_user() -> str:
+    conn = await asyncpg.connect(ASYNCPG_DSN)
+    try:
+        email = await conn.fetchval(
+            "SELECT u.email FROM users u JOIN chat_users cu ON cu.user_id = u.id "
+            "WHERE u.email LIKE '%@load.test' ORDER BY u.id LIMIT 1"
+        )
+    finally:
+        await conn.close()
+    if email is None:
+        raise SystemExit("Нет пользователей генератора, запустите с --seed")
+    return email
+
+
+if __name__ == "__main__":
+    main()
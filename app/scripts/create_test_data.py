@@ -64,6 +64,7 @@ async def create_test_data():
                 text=f"Тестовое сообщение {i}",
                 chat_id=private_chat.id,
                 sender_id=users[i % 2].id,
+                seq=10 - i,
                 timestamp=datetime.utcnow() - timedelta(minutes=i),
                 created_at=datetime.utcnow() - timedelta(minutes=i)
             )
@@ -76,6 +77,7 @@ async def create_test_data():
                 text=f"Групповое сообщение {i}",
                 chat_id=group_chat.id,
                 sender_id=users[i % len(users)].id,
+                seq=15 - i,
                 timestamp=datetime.utcnow() - timedelta(minutes=i),
                 created_at=datetime.utcnow() - timedelta(minutes=i)
             )
@@ -0,0 +1,224 @@
+import argparse
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+import asyncpg
+from passlib.context import CryptContext
+
+from app.db import SQLALCHEMY_DATABASE_URL
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+)
+logger = logging.getLogger("generate_load_data")
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+ASYNCPG_DSN = SQLALCHEMY_DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://")
+
+WORDS = (
+    "привет как дела что нового созвон завтра отчет готов посмотри задачу "
+    "релиз тесты упали починил ок спасибо встреча через час лог ошибка "
+    "деплой база индекс запрос"
+).split()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Генерация большого объема тестовых данных через COPY"
+    )
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--chats", type=int, default=20_000)
+    parser.add_argument(
+        "--private-ratio",
+        type=float,
+        default=0.7,
+        help="Доля приватных чатов, остальные групповые",
+    )
+    parser.add_argument("--group-size-min", type=int, default=3)
+    parser.add_argument("--group-size-max", type=int, default=500)
+    parser.add_argument(
+        "--group-size-alpha",
+        type=float,
+        default=1.5,
+        help="Параметр распределения Парето для размера групп",
+    )
+    parser.add_argument(
+        "--messages-per-chat",
+        type=int,
+        default=100,
+        help="Среднее число сообщений в чате (экспоненциальное распределение)",
+    )
+    parser.add_argument("--days", type=int, default=365, help="Временной диапазон сообщений")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=50_000)
+    parser.add_argument("--password", default="password123")
+    parser.add_argument("--seed", type=int, default=None)
+    return parser.parse_args(argv)
+
+
+async def next_id(conn, table: str) -> int:
+    return await conn.fetchval(f"SELECT coalesce(max(id), 0) + 1 FROM {table}")
+
+
+async def reset_sequence(conn, table: str) -> None:
+    await conn.execute(
+        f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+        f"(SELECT coalesce(max(id), 1) FROM {table}))"
+    )
+
+
+def build_chats(args, rng, first_user_id, first_chat_id, first_group_id):
+    """Раскладывает чаты по типам и участникам.
+
+    Возвращает строки для chats/groups/chat_users/group_members и план сообщений:
+    (chat_id, число сообщений, участники).
+    """
+    user_ids = range(first_user_id, first_user_id + args.users)
+    group_size_max = min(args.group_size_max, args.users)
+    chats, groups, chat_members, group_member_rows, plan = [], [], [], [], []
+    group_id = first_group_id
+    for offset in range(args.chats):
+        chat_id = first_chat_id + offset
+        if rng.random() < args.private_ratio or group_size_max < 3:
+            members = rng.sample(user_ids, 2)
+            chats.append((chat_id, f"Чат {chat_id}", "private"))
+        else:
+            size = int(args.group_size_min * rng.paretovariate(args.group_size_alpha))
+            size = max(args.group_size_min, min(size, group_size_max))
+            members = rng.sample(user_ids, size)
+            chats.append((chat_id, f"Группа {chat_id}", "group"))
+            groups.append((group_id, chat_id, f"Группа {chat_id}", members[0]))
+            group_member_rows.extend((group_id, uid) for uid in members)
+            group_id += 1
+        chat_members.extend((chat_id, uid) for uid in members)
+        count = int(rng.expovariate(1 / args.messages_per_chat)) if args.messages_per_chat else 0
+        plan.append((chat_id, count, members))
+    return chats, groups, chat_members, group_member_rows, plan
+
+
+def iter_messages(chunk, first_message_id, span, now, seed):
+    rng = random.Random(seed)
+    message_id = first_message_id
+    for chat_id, count, members in chunk:
+        if not count:
+            continue
+        start = now - span * rng.random()
+        step = (now - start) / count
+        for i in range(count):
+            timestamp = start + step * i
+            yield (
+                message_id,
+                " ".join(rng.choices(WORDS, k=rng.randint(2, 12))),
+                chat_id,
+                rng.choice(members),
+                timestamp,
+                False,
+                timestamp.replace(tzinfo=None),
+                i + 1,
+            )
+            message_id += 1
+
+
+async def copy_messages(worker_id, chunk, first_message_id, args, span, now):
+    conn = await asyncpg.connect(ASYNCPG_DSN)
+    try:
+        await conn.execute("SET synchronous_commit = off")
+        seed = None if args.seed is None else args.seed * 1000 + worker_id
+        rows = iter_messages(chunk, first_message_id, span, now, seed)
+        copied = 0
+        while True:
+            batch = [row for _, row in zip(range(args.batch_size), rows)]
+            if not batch:
+                break
+            await conn.copy_records_to_table(
+                "messages",
+                records=batch,
+                columns=[
+                    "id",
+                    "text",
+                    "chat_id",
+                    "sender_id",
+                    "timestamp",
+                    "is_read",
+                    "created_at",
+                    "seq",
+                ],
+            )
+            copied += len(batch)
+            logger.info(f"Воркер {worker_id}: загружено {copied} сообщений")
+        return copied
+    finally:
+        await conn.close()
+
+
+async def generate(args):
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    password_hash = pwd_context.hash(args.password)
+
+    conn = await asyncpg.connect(ASYNCPG_DSN)
+    try:
+        first_user_id = await next_id(conn, "users")
+        first_chat_id = await next_id(conn, "chats")
+        first_group_id = await next_id(conn, "groups")
+        first_message_id = await next_id(conn, "messages")
+
+        users = [
+            (uid, f"Пользователь {uid}", f"user{uid}@load.test", password_hash)
+            for uid in range(first_user_id, first_user_id + args.users)
+        ]
+        chats, groups, chat_members, group_member_rows, plan = build_chats(
+            args, rng, first_user_id, first_chat_id, first_group_id
+        )
+        async with conn.transaction():
+            await conn.copy_records_to_table(
+                "users", records=users, columns=["id", "name", "email", "password"]
+            )
+            await conn.copy_records_to_table(
+                "chats", records=chats, columns=["id", "name", "chat_type"]
+            )
+            await conn.copy_records_to_table(
+                "groups", records=groups, columns=["id", "chat_id", "name", "creator_id"]
+            )
+            await conn.copy_records_to_table(
+                "chat_users", records=chat_members, columns=["chat_id", "user_id"]
+            )
+            await conn.copy_records_to_table(
+                "group_members", records=group_member_rows, columns=["group_id", "user_id"]
+            )
+        logger.info(
+            f"Загружено: {len(users)} пользователей, {len(chats)} чатов, "
+            f"{len(chat_members)} участников"
+        )
+
+        workers = max(1, args.workers)
+        chunks = [plan[i::workers] for i in range(workers)]
+        tasks = []
+        message_id = first_message_id
+        now = datetime.now(timezone.utc)
+        span = timedelta(days=args.days)
+        for worker_id, chunk in enumerate(chunks):
+            tasks.append(copy_messages(worker_id, chunk, message_id, args, span, now))
+            message_id += sum(count for _, count, _ in chunk)
+        copied = sum(await asyncio.gather(*tasks))
+
+        for table in ("users", "chats", "groups", "messages"):
+            await reset_sequence(conn, table)
+        await conn.execute("ANALYZE")
+    finally:
+        await conn.close()
+
+    elapsed = time.perf_counter() - started
+    logger.info(
+        f"Готово: {copied} сообщений за {elapsed:.1f} с "
+        f"({copied / max(elapsed, 1e-9):.0f} сообщений/с)"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(generate(parse_args()))
@@ -0,0 +1,160 @@
+import argparse
+import asyncio
+import gc
+import random
+import sys
+import time
+import tracemalloc
+
+from app.service.connection_manager import ConnectionManager
+from app.service.timer_wheel import TimerWheel
+
+# Soak-тест churn-а WebSocket-соединений без сети и БД.
+# Поддельные сокеты подключаются и отключаются волнами; часть из них "мертвые":
+# не отвечают на ping и никогда не вызывают disconnect, их должен убрать
+# heartbeat. После прогрева память, отслеживаемая tracemalloc, не должна расти,
+# а после каждой волны не должно оставаться соединений и таймеров.
+#
+#   python -m app.scripts.soak_connections --duration 10800
+
+
+class FakeWebSocket:
+    __slots__ = ("manager", "alive", "closed")
+
+    def __init__(self, manager: ConnectionManager, alive: bool):
+        self.manager = manager
+        self.alive = alive
+        self.closed = False
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, message):
+        if self.closed:
+            raise RuntimeError("socket closed")
+        if self.alive and message.get("type") == "ping":
+            self.manager.touch(self)
+
+    async def send_text(self, message):
+        if self.closed:
+            raise RuntimeError("socket closed")
+
+    async def close(self, code: int = 1000):
+        self.closed = True
+
+
+async def client(manager: ConnectionManager, chat_id: int, user_id: int, alive: bool, lifetime: float):
+    websocket = FakeWebSocket(manager, alive)
+    await manager.connect(chat_id, websocket, user_id)
+    await asyncio.sleep(lifetime)
+    if alive:
+        await manager.disconnect(chat_id, websocket, user_id)
+
+
+async def user_client(manager: ConnectionManager, chat_ids, user_id: int, alive: bool, lifetime: float):
+    websocket = FakeWebSocket(manager, alive)
+    await manager.connect_user(websocket, user_id, chat_ids)
+    await asyncio.sleep(lifetime)
+    if alive:
+        manager.remove(websocket)
+
+
+async def churn(manager: ConnectionManager, rng: random.Random, args, seconds: float) -> int:
+    tasks = set()
+    waves = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for _ in range(args.wave):
+            alive = rng.random() >= args.dead_ratio
+            lifetime = rng.uniform(0, args.max_lifetime)
+            user_id = rng.randrange(args.users)
+            if rng.random() < args.multiplexed_ratio:
+                chat_ids = rng.sample(range(args.chats), args.chats_per_user)
+                coro = user_client(manager, chat_ids, user_id, alive, lifetime)
+            else:
+                coro = client(manager, rng.randrange(args.chats), user_id, alive, lifetime)
+            task = asyncio.create_task(coro)
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        waves += 1
+        await asyncio.sleep(args.wave_interval)
+    await asyncio.gather(*tasks)
+    # Ждем, пока heartbeat уберет мертвые соединения.
+    await asyncio.sleep(args.idle_timeout + args.ping_interval + 2 * args.tick)
+    return waves
+
+
+async def soak(args) -> int:
+    manager = ConnectionManager(
+        ping_interval=args.ping_interval,
+        idle_timeout=args.idle_timeout,
+        wheel=TimerWheel(tick=args.tick),
+    )
+    rng = random.Random(args.seed)
+    tracemalloc.start()
+    started = time.monotonic()
+    await churn(manager, rng, args, args.warmup)
+
+    # Память меряется в спокойные моменты между волнами churn-а: к этому времени
+    # все соединения либо отключились сами, либо убраны heartbeat-ом, и любой
+    # рост относительно первого замера - утечка.
+    baseline = None
+    peak_growth = 0
+    leaked = 0
+    while time.monotonic() - started < args.duration:
+        waves = await churn(manager, rng, args, args.sample_interval)
+        gc.collect()
+        current, _ = tracemalloc.get_traced_memory()
+        if baseline is None:
+            baseline = current
+        growth = current - baseline
+        peak_growth = max(peak_growth, growth)
+        leaked = (
+            len(manager.connections)
+            + len(manager.active_connections)
+            + len(manager.user_connections)
+            + len(manager.wheel)
+        )
+        print(
+            f"t={time.monotonic() - started:8.0f}s волн={waves} "
+            f"осталось соединений/чатов/таймеров={leaked} "
+            f"память={current / 1024:.0f} KiB рост={growth / 1024:+.0f} KiB",
+            flush=True,
+        )
+        if leaked:
+            break
+
+    await manager.wheel.stop()
+    tracemalloc.stop()
+
+    print(f"Максимальный рост памяти после прогрева: {peak_growth / 1024:.0f} KiB")
+    if leaked or peak_growth > args.max_growth_kib * 1024:
+        print("FAIL")
+        return 1
+    print("OK")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak-тест churn-а WebSocket-соединений")
+    parser.add_argument("--duration", type=float, default=60, help="Длительность, с")
+    parser.add_argument("--warmup", type=float, default=10)
+    parser.add_argument("--sample-interval", type=float, default=10, help="Длительность волны churn-а между замерами, с")
+    parser.add_argument("--wave", type=int, default=100, help="Подключений за волну")
+    parser.add_argument("--wave-interval", type=float, default=0.05)
+    parser.add_argument("--max-lifetime", type=float, default=2.0)
+    parser.add_argument("--dead-ratio", type=float, default=0.2)
+    parser.add_argument("--chats", type=int, default=500)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--multiplexed-ratio", type=float, default=0.5, help="Доля соединений /ws на все чаты")
+    parser.add_argument("--chats-per-user", type=int, default=20)
+    parser.add_argument("--tick", type=float, default=0.05)
+    parser.add_argument("--ping-interval", type=float, default=0.25)
+    parser.add_argument("--idle-timeout", type=float, default=0.6)
+    parser.add_argument("--max-growth-kib", type=float, default=256)
+    parser.add_argument("--seed", type=int, default=None)
+    sys.exit(asyncio.run(soak(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
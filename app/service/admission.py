@@ -0,0 +1,117 @@
+import math
+import os
+import time
+from typing import Dict, Optional
+
+import logging
+
+logger = logging.getLogger("admission")
+
+SEND = "send"
+READ = "read"
+
+
+class AdmissionController:
+    """Адаптивный лимит одновременной работы с БД (AIMD по задержке).
+
+    Каждый допущенный запрос - одна единица in-flight; его время от допуска до
+    завершения включает и ожидание соединения в пуле, и сами запросы. Пока
+    задержка не выше target, лимит растет на 1/limit за каждый запрос (примерно
+    +1 за «окно»), но только если лимит реально выбирается. Когда задержка выше
+    target или пул отдал таймаут, лимит умножается на backoff, не чаще раза на
+    одно окно: запросы, начатые до последнего снижения, его уже не снижают.
+
+    Чтения (история, список чатов, экспорт) могут занять не больше read_share
+    лимита, отправка сообщений - весь лимит, поэтому при перегрузке первыми
+    отбрасываются чтения. Сверх лимита запрос сразу отклоняется, очереди нет:
+    ожидание в очереди - это та же неограниченная задержка.
+    """
+
+    def __init__(
+        self,
+        initial_limit: float = 20,
+        min_limit: float = 2,
+        max_limit: float = 200,
+        target_latency: float = 0.05,
+        backoff: float = 0.9,
+        read_share: float = 0.75,
+        smoothing: float = 0.1,
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.read_share = read_share
+        self.smoothing = smoothing
+        self.latency: Optional[float] = None
+        self.inflight: Dict[str, int] = {SEND: 0, READ: 0}
+        self.admitted: Dict[str, int] = {SEND: 0, READ: 0}
+        self.rejected: Dict[str, int] = {SEND: 0, READ: 0}
+        self._last_decrease = float("-inf")
+
+    def _capacity(self, priority: str) -> float:
+        return self.limit if priority == SEND else self.limit * self.read_share
+
+    def try_acquire(self, priority: str) -> Optional[float]:
+        """Допускает запрос. Возвращает метку начала или None, если места нет."""
+        total = self.inflight[SEND] + self.inflight[READ]
+        if total + 1 > self._capacity(priority):
+            self.rejected[priority] += 1
+            return None
+        self.inflight[priority] += 1
+        self.admitted[priority] += 1
+        return time.monotonic()
+
+    def release(
+        self, priority: str, started: float, dropped: bool = False, sample: bool = True
+    ) -> None:
+        """Освобождает место. sample=False - без замера задержки: так отпускают
+        потоковые ответы, чья длительность задается скоростью клиента, а не БД."""
+        self.inflight[priority] -= 1
+        if sample or dropped:
+            self.observe(started, dropped)
+
+    def observe(self, started: float, dropped: bool = False) -> None:
+        """Учитывает задержку запроса, начатого в started, и подстраивает лимит."""
+        now = time.monotonic()
+        latency = now - started
+        self.latency = (
+            latency
+            if self.latency is None
+            else self.latency + self.smoothing * (latency - self.latency)
+        )
+        if dropped or latency > self.target_latency:
+            if started >= self._last_decrease:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_decrease = now
+                logger.info(f"Лимит допуска снижен до {self.limit:.1f} (задержка {latency * 1000:.0f} мс)")
+        elif (self.inflight[SEND] + self.inflight[READ] + 1) * 2 >= self.limit:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def retry_after(self) -> float:
+        """Оценка, через сколько секунд стоит повторить: порядок задержки запроса."""
+        return max(0.1, 2 * (self.latency or self.target_latency))
+
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after())))
+
+    def stats(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "read_limit": round(self.limit * self.read_share, 2),
+            "target_ms": self.target_latency * 1000,
+            "latency_ms": round((self.latency or 0) * 1000, 3),
+            "inflight": dict(self.inflight),
+            "admitted": dict(self.admitted),
+            "rejected": dict(self.rejected),
+        }
+
+
+admission = AdmissionController(
+    initial_limit=float(os.getenv("ADMISSION_INITIAL_LIMIT", 20)),
+    min_limit=float(os.getenv("ADMISSION_MIN_LIMIT", 2)),
+    max_limit=float(os.getenv("ADMISSION_MAX_LIMIT", 200)),
+    target_latency=float(os.getenv("ADMISSION_TARGET_MS", 50)) / 1000,
+    read_share=float(os.getenv("ADMISSION_READ_SHARE", 0.75)),
+)
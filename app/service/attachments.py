@@ -0,0 +1,113 @@
+import hashlib
+import os
+import uuid
+from typing import AsyncIterator, Optional, Tuple
+
+import anyio
+from sqlalchemy import exists, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.tables import Attachment, Message, chat_users
+
+import logging
+
+logger = logging.getLogger("attachments")
+
+ATTACHMENTS_DIR = os.getenv("ATTACHMENTS_DIR", "data/attachments")
+ATTACHMENTS_MAX_SIZE = int(os.getenv("ATTACHMENTS_MAX_SIZE", 50 * 1024 * 1024))
+# Файлы копятся в памяти до WRITE_BUFFER байт и пишутся на диск одним вызовом
+# в пуле потоков, а не по одному маленькому чанку тела запроса.
+WRITE_BUFFER = 1024 * 1024
+
+
+class AttachmentTooLarge(Exception):
+    pass
+
+
+def blob_key(sha256: str) -> str:
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
+def blob_path(sha256: str) -> str:
+    return os.path.join(ATTACHMENTS_DIR, *blob_key(sha256).split("/"))
+
+
+async def store_stream(
+    chunks: AsyncIterator[bytes], max_size: int = ATTACHMENTS_MAX_SIZE
+) -> Tuple[str, int]:
+    """Пишет поток во временный файл, считая sha256, и кладет его под хэшем.
+
+    В памяти держится не больше WRITE_BUFFER байт. Если такой файл уже есть,
+    временный просто удаляется - содержимое хранится один раз.
+    """
+    tmp_dir = os.path.join(ATTACHMENTS_DIR, "tmp")
+    await anyio.to_thread.run_sync(lambda: os.makedirs(tmp_dir, exist_ok=True))
+    tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+    digest = hashlib.sha256()
+    size = 0
+    buffer = bytearray()
+    f = await anyio.to_thread.run_sync(open, tmp_path, "wb")
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > max_size:
+                raise AttachmentTooLarge()
+            digest.update(chunk)
+            buffer += chunk
+            if len(buffer) >= WRITE_BUFFER:
+                await anyio.to_thread.run_sync(f.write, bytes(buffer))
+                buffer.clear()
+        if buffer:
+            await anyio.to_thread.run_sync(f.write, bytes(buffer))
+        await anyio.to_thread.run_sync(f.close)
+
+        sha256 = digest.hexdigest()
+        path = blob_path(sha256)
+
+        def publish() -> None:
+            if os.path.exists(path):
+                os.remove(tmp_path)
+                return
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+
+        await anyio.to_thread.run_sync(publish)
+        return sha256, size
+    except BaseException:
+        f.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+async def get_accessible(
+    session: AsyncSession, attachment_id: int, user_id: int
+) -> Optional[Attachment]:
+    """Вложение, если пользователь его загрузил или состоит в чате, где оно отправлено."""
+    attachment = await session.get(Attachment, attachment_id)
+    if attachment is None:
+        return None
+    if attachment.uploader_id == user_id:
+        return attachment
+    shared = await session.scalar(
+        select(
+            exists()
+            .where(
+                Message.attachment_id == attachment_id,
+                chat_users.c.chat_id == Message.chat_id,
+                chat_users.c.user_id == user_id,
+            )
+        )
+    )
+    return attachment if shared else None
+
+
+def attachment_meta(attachment: Attachment) -> dict:
+    return {
+        "id": attachment.id,
+        "filename": attachment.filename,
+        "content_type": attachment.content_type,
+        "size": attachment.size,
+        "sha256": attachment.sha256,
+        "url": f"/attachments/{attachment.id}",
+    }
@@ -1,50 +1,290 @@
-from typing import Dict, List, Tuple
+import asyncio
+import json
+import time
+from typing import Dict, Iterable, Optional, Set
 
 from fastapi import WebSocket
 
+from app.service.timer_wheel import Timer, TimerWheel
+
+import logging
+
+logger = logging.getLogger("connection_manager")
+
+
+def encode(message: dict) -> str:
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+class ConnectionState:
+    __slots__ = ("user_id", "chats", "last_seen", "timer", "multiplexed")
+
+    def __init__(self, user_id: int, multiplexed: bool = False):
+        self.user_id = user_id
+        self.chats: Set[int] = set()
+        self.last_seen = time.monotonic()
+        self.timer: Optional[Timer] = None
+        self.multiplexed = multiplexed
+
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[int, List[Tuple[WebSocket, int]]] = {}
+    """Живые WebSocket-соединения.
 
-    async def connect(self, chat_id: int, websocket: WebSocket, user_id: int) -> None:
+    active_connections - подписчики чата (сокет -> пользователь), user_connections -
+    сокеты пользователя. Сокет /ws/{chat_id} подписан на один чат и забывается,
+    когда от него отписываются; мультиплексный сокет /ws живет, пока открыт,
+    даже без подписок.
+    """
+
+    def __init__(
+        self,
+        ping_interval: float = 20.0,
+        idle_timeout: float = 60.0,
+        notify_interval: float = 1.0,
+        wheel: Optional[TimerWheel] = None,
+        send_timeout: float = 5.0,
+    ):
+        self.active_connections: Dict[int, Dict[WebSocket, int]] = {}
+        self.user_connections: Dict[int, Set[WebSocket]] = {}
+        self.connections: Dict[WebSocket, ConnectionState] = {}
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self.notify_interval = notify_interval
+        self.send_timeout = send_timeout
+        self.wheel = wheel if wheel is not None else TimerWheel(tick=1.0)
+        self.delivery_modes: Dict[int, str] = {}
+        self._pending_notifications: Dict[int, int] = {}
+
+    async def accept(
+        self, websocket: WebSocket, user_id: int, multiplexed: bool = False
+    ) -> ConnectionState:
         await websocket.accept()
-        if chat_id not in self.active_connections:
-            self.active_connections[chat_id] = []
+        state = self.connections.get(websocket)
+        if state is None:
+            state = self.connections[websocket] = ConnectionState(user_id, multiplexed)
+            self.user_connections.setdefault(user_id, set()).add(websocket)
+            self._schedule_heartbeat(websocket, state)
+        self.wheel.start()
+        return state
 
-        if not any(
-            ws is websocket and uid == user_id
-            for ws, uid in self.active_connections[chat_id]
-        ):
-            self.active_connections[chat_id].append((websocket, user_id))
+    def subscribe(self, chat_id: int, websocket: WebSocket) -> None:
+        state = self.connections.get(websocket)
+        if state is None:
+            return
+        self.active_connections.setdefault(chat_id, {})[websocket] = state.user_id
+        state.chats.add(chat_id)
+
+    def unsubscribe(self, chat_id: int, websocket: WebSocket) -> None:
+        subscribers = self.active_connections.get(chat_id)
+        if subscribers is not None:
+            subscribers.pop(websocket, None)
+            if not subscribers:
+                del self.active_connections[chat_id]
+        state = self.connections.get(websocket)
+        if state is not None:
+            state.chats.discard(chat_id)
+
+    async def connect(self, chat_id: int, websocket: WebSocket, user_id: int) -> None:
+        await self.accept(websocket, user_id)
+        self.subscribe(chat_id, websocket)
+
+    async def connect_user(
+        self, websocket: WebSocket, user_id: int, chat_ids: Iterable[int]
+    ) -> None:
+        await self.accept(websocket, user_id, multiplexed=True)
+        for chat_id in chat_ids:
+            self.subscribe(chat_id, websocket)
 
     async def disconnect(
         self, chat_id: int, websocket: WebSocket, user_id: int
     ) -> None:
-        if chat_id in self.active_connections:
-            self.active_connections[chat_id] = [
-                (ws, uid)
-                for ws, uid in self.active_connections[chat_id]
-                if not (ws is websocket and uid == user_id)
-            ]
-            if not self.active_connections[chat_id]:
-                del self.active_connections[chat_id]
+        self.unsubscribe(chat_id, websocket)
+        state = self.connections.get(websocket)
+        if state is not None and not state.multiplexed and not state.chats:
+            self._forget(websocket)
+
+    def remove(self, websocket: WebSocket) -> None:
+        """Убирает соединение из всех чатов и из менеджера."""
+        state = self.connections.get(websocket)
+        if state is None:
+            return
+        for chat_id in list(state.chats):
+            self.unsubscribe(chat_id, websocket)
+        self._forget(websocket)
+
+    def _forget(self, websocket: WebSocket) -> None:
+        state = self.connections.pop(websocket, None)
+        if state is None:
+            return
+        if state.timer is not None:
+            state.timer.cancel()
+            state.timer = None
+        sockets = self.user_connections.get(state.user_id)
+        if sockets is not None:
+            sockets.discard(websocket)
+            if not sockets:
+                del self.user_connections[state.user_id]
+
+    def touch(self, websocket: WebSocket) -> None:
+        state = self.connections.get(websocket)
+        if state is not None:
+            state.last_seen = time.monotonic()
+
+    def is_subscribed(self, websocket: WebSocket, chat_id: int) -> bool:
+        state = self.connections.get(websocket)
+        return state is not None and chat_id in state.chats
+
+    def subscribed_users(self, chat_id: int) -> Set[int]:
+        return set(self.active_connections.get(chat_id, {}).values())
+
+    def _schedule_heartbeat(self, websocket: WebSocket, state: ConnectionState) -> None:
+        state.timer = self.wheel.schedule(
+            self.ping_interval, lambda: self._heartbeat(websocket)
+        )
+
+    async def _heartbeat(self, websocket: WebSocket) -> None:
+        state = self.connections.get(websocket)
+        if state is None:
+            return
+        state.timer = None
+        if time.monotonic() - state.last_seen > self.idle_timeout:
+            logger.info(f"Соединение пользователя {state.user_id} не отвечает, закрываем")
+            await self.drop(websocket)
+            return
+        try:
+            await asyncio.wait_for(
+                websocket.send_json({"type": "ping"}), timeout=self.ping_interval
+            )
+        except Exception:
+            await self.drop(websocket)
+            return
+        if websocket in self.connections:
+            self._schedule_heartbeat(websocket, state)
+
+    async def drop(self, websocket: WebSocket) -> None:
+        """Убирает соединение из всех чатов и закрывает сокет."""
+        if websocket not in self.connections:
+            return
+        self.remove(websocket)
+        try:
+            await websocket.close(code=1001)
+        except Exception:
+            pass
+
+    async def close_chat(self, chat_id: int) -> None:
+        """Отписывает всех от удаленного чата; сокеты /ws/{chat_id} закрываются."""
+        for websocket in list(self.active_connections.get(chat_id, ())):
+            state = self.connections.get(websocket)
+            if state is not None and not state.multiplexed:
+                await self.drop(websocket)
+            else:
+                self.unsubscribe(chat_id, websocket)
+        self.delivery_modes.pop(chat_id, None)
+        self._pending_notifications.pop(chat_id, None)
+
+    async def update_members(
+        self, chat_id: int, added: Iterable[int], removed: Iterable[int]
+    ) -> None:
+        """Применяет изменение состава чата к живым сокетам за один проход.
+
+        Мультиплексные сокеты добавленных подписываются на чат, удаленных -
+        отписываются; сокеты /ws/{chat_id} удаленных закрываются. Каждый
+        затронутый сокет получает кадр membership, текст кадра кодируется
+        один раз на состояние.
+        """
+        frames = {
+            status: encode({"type": "membership", "chat_id": chat_id, "status": status})
+            for status in ("added", "removed")
+        }
+        notify = []
+        for user_id in added:
+            for websocket in self.user_connections.get(user_id, ()):
+                if self.connections[websocket].multiplexed:
+                    self.subscribe(chat_id, websocket)
+                    notify.append((websocket, frames["added"]))
+        to_drop = []
+        for user_id in removed:
+            for websocket in self.user_connections.get(user_id, ()):
+                state = self.connections[websocket]
+                if chat_id not in state.chats:
+                    continue
+                if state.multiplexed:
+                    self.unsubscribe(chat_id, websocket)
+                    notify.append((websocket, frames["removed"]))
+                else:
+                    to_drop.append(websocket)
+        for websocket, text in notify:
+            try:
+                await websocket.send_text(text)
+            except Exception:
+                pass
+        for websocket in to_drop:
+            await self.drop(websocket)
+
+    async def drop_user(self, user_id: int) -> None:
+        for websocket in list(self.user_connections.get(user_id, ())):
+            await self.drop(websocket)
+
+    async def shutdown(self) -> None:
+        """Закрывает все сокеты с кодом 1001 и останавливает колесо таймеров."""
+        await asyncio.gather(
+            *(self.drop(websocket) for websocket in list(self.connections)),
+            return_exceptions=True,
+        )
+        await self.wheel.stop()
+
+    def set_delivery_mode(self, chat_id: int, mode: str) -> None:
+        self.delivery_modes[chat_id] = mode
+
+    async def _send_text_all(self, chat_id: int, text: str) -> None:
+        # Как и в _heartbeat, отправка ограничена по времени: сокет, который не
+        # принял кадр за send_timeout, закрывается и не задерживает остальных
+        # подписчиков при следующих рассылках.
+        for websocket in list(self.active_connections.get(chat_id, {})):
+            try:
+                await asyncio.wait_for(
+                    websocket.send_text(text), timeout=self.send_timeout
+                )
+            except Exception:
+                await self.drop(websocket)
 
     async def broadcast(self, chat_id: int, message: dict) -> None:
         if chat_id in self.active_connections:
-            for websocket, _ in list(self.active_connections[chat_id]):
-                try:
-                    await websocket.send_json(message)
-                except Exception:
-                    await self.disconnect(chat_id, websocket, _)
+            await self._send_text_all(chat_id, encode(message))
+
+    async def publish(self, chat_id: int, message: dict) -> None:
+        """Доставляет новое сообщение с учетом режима чата.
+
+        В режиме pull тело не рассылается: чат помечается, и не чаще раза в
+        notify_interval участники получают один общий кадр "есть сообщения до
+        seq N", а тела забирают сами через кешируемый эндпоинт пачек. Стоимость
+        отправки одного сообщения от числа участников не зависит.
+        """
+        if self.delivery_modes.get(chat_id) != "pull":
+            await self.broadcast(chat_id, message)
+            return
+        if chat_id not in self.active_connections:
+            return
+        pending = self._pending_notifications.get(chat_id)
+        if pending is None:
+            self.wheel.schedule(self.notify_interval, lambda: self._flush_notification(chat_id))
+        self._pending_notifications[chat_id] = max(message["seq"], pending or 0)
+
+    async def _flush_notification(self, chat_id: int) -> None:
+        seq = self._pending_notifications.pop(chat_id, None)
+        if seq is None:
+            return
+        await self._send_text_all(
+            chat_id, encode({"type": "new_messages", "chat_id": chat_id, "seq": seq})
+        )
 
     async def send_personal_message(
         self, chat_id: int, user_id: int, message: dict
     ) -> None:
-        if chat_id in self.active_connections:
-            for websocket, uid in self.active_connections[chat_id]:
-                if uid == user_id:
-                    try:
-                        await websocket.send_json(message)
-                    except Exception:
-                        pass
+        text = encode(message)
+        for websocket in list(self.user_connections.get(user_id, ())):
+            if self.is_subscribed(websocket, chat_id):
+                try:
+                    await websocket.send_text(text)
+                except Exception:
+                    pass
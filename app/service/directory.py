@@ -0,0 +1,166 @@
+import base64
+import json
+import sys
+import time
+from collections import OrderedDict
+from typing import Hashable, List, Optional, Tuple
+
+from sqlalchemy import and_, func, or_, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.tables import User
+
+import logging
+
+logger = logging.getLogger("directory")
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class SearchCache:
+    """Первые страницы поиска по горячим префиксам.
+
+    Набор текста дает один и тот же короткий префикс у множества клиентов,
+    поэтому страница держится ttl секунд; сверх max_items вытесняются давно
+    не запрошенные. Новый пользователь появляется в поиске не позже чем
+    через ttl.
+    """
+
+    def __init__(self, max_items: int = 10_000, ttl: float = 30.0):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._items: "OrderedDict[Hashable, Tuple[dict, float]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[dict]:
+        entry = self._items.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: Hashable, value: dict) -> None:
+        self._items[key] = (value, time.monotonic() + self.ttl)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+def encode_cursor(key, user_id: int) -> str:
+    raw = json.dumps([key, user_id], separators=(",", ":"), ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key, user_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    if not isinstance(user_id, int):
+        raise InvalidCursor(cursor)
+    return key, user_id
+
+
+def search_column(query: str):
+    # Выражения совпадают с индексами из миграции: lower(...) для триграмм и
+    # lower(...) COLLATE "C" для префикса (см. search_prefix).
+    return func.lower(User.email if "@" in query else User.name)
+
+
+def prefix_upper(prefix: str) -> Optional[str]:
+    """Наименьшая строка больше всех строк, начинающихся с prefix.
+
+    None, если такой нет: prefix состоит из одних U+10FFFF.
+    """
+    # U+10FFFF увеличить нельзя - он отбрасывается, и увеличивается
+    # предыдущий символ. Суррогаты в UTF-8 не кодируются и пропускаются.
+    stripped = prefix.rstrip(chr(sys.maxunicode))
+    if not stripped:
+        return None
+    code = ord(stripped[-1]) + 1
+    if 0xD800 <= code <= 0xDFFF:
+        code = 0xE000
+    return stripped[:-1] + chr(code)
+
+
+async def search_prefix(
+    session: AsyncSession, query: str, limit: int, cursor: Optional[str] = None
+) -> Tuple[List[dict], Optional[str]]:
+    """Пользователи, у которых имя (или email, если в запросе есть @) начинается с query.
+
+    Сортировка по (lower(name), id), страницы - по ключу последней строки:
+    глубина страницы не влияет на стоимость запроса.
+    """
+    # В C-сопоставлении порядок строк - порядок кодовых точек, поэтому префикс
+    # превращается в диапазон [prefix, prefix_upper) по обычному btree, и
+    # индекс используется и в generic-плане подготовленного запроса, чего
+    # LIKE с параметром не гарантирует.
+    prefix = query.lower()
+    column = search_column(query).collate("C")
+    key = column.label("key")
+    q = (
+        select(User.id, User.name, key)
+        .where(column >= prefix, User.deleted_at.is_(None))
+        .order_by(column, User.id)
+        .limit(limit + 1)
+    )
+    upper = prefix_upper(prefix)
+    if upper is not None:
+        q = q.where(column < upper)
+    if cursor is not None:
+        last_key, last_id = decode_cursor(cursor)
+        if not isinstance(last_key, str):
+            raise InvalidCursor(cursor)
+        q = q.where(tuple_(column, User.id) > tuple_(last_key, last_id))
+    rows = (await session.execute(q)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].key, rows[-1].id)
+    return [{"id": row.id, "name": row.name} for row in rows], next_cursor
+
+
+async def search_fuzzy(
+    session: AsyncSession, query: str, limit: int, cursor: Optional[str] = None
+) -> Tuple[List[dict], Optional[str]]:
+    """Нечеткий поиск по триграммам (pg_trgm), самые похожие первыми.
+
+    Оператор % отбирает строки по триграммному GIN-индексу с порогом
+    pg_trgm.similarity_threshold, страницы - по ключу (similarity, id).
+    """
+    term = query.lower()
+    column = search_column(query)
+    similarity = func.similarity(column, term)
+    q = (
+        select(User.id, User.name, similarity.label("key"))
+        .where(column.op("%")(term), User.deleted_at.is_(None))
+        .order_by(similarity.desc(), User.id)
+        .limit(limit + 1)
+    )
+    if cursor is not None:
+        last_key, last_id = decode_cursor(cursor)
+        if not isinstance(last_key, (int, float)):
+            raise InvalidCursor(cursor)
+        q = q.where(
+            or_(
+                similarity < last_key,
+                and_(similarity == last_key, User.id > last_id),
+            )
+        )
+    rows = (await session.execute(q)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].key, rows[-1].id)
+    return [{"id": row.id, "name": row.name} for row in rows], next_cursor
@@ -0,0 +1,67 @@
+import json
+import os
+import zlib
+from typing import AsyncIterator
+
+from sqlalchemy import select
+
+from app.db import AsyncSessionLocal
+from app.models.tables import Message
+
+import logging
+
+logger = logging.getLogger("history_export")
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+
+EXPORT_COLUMNS = (
+    Message.id,
+    Message.chat_id,
+    Message.sender_id,
+    Message.seq,
+    Message.text,
+    Message.client_message_id,
+    Message.attachment_id,
+    Message.timestamp,
+    Message.created_at,
+)
+
+
+def _row_to_line(row) -> str:
+    item = dict(row._mapping)
+    for key in ("timestamp", "created_at"):
+        if item[key] is not None:
+            item[key] = item[key].isoformat()
+    return json.dumps(item, ensure_ascii=False) + "\n"
+
+
+async def iter_history_ndjson(
+    chat_id: int, compress: bool = False, sessionmaker=AsyncSessionLocal
+) -> AsyncIterator[bytes]:
+    """Отдает историю чата в NDJSON, читая ее серверным курсором.
+
+    Сессия открывается внутри генератора: зависимость get_async_session
+    закрывается раньше, чем StreamingResponse начнет отправку тела.
+    В памяти одновременно держится не больше EXPORT_BATCH_SIZE строк,
+    а следующая пачка читается только после того, как клиент забрал предыдущую.
+    """
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if compress else None
+    exported = 0
+    async with sessionmaker() as session:
+        result = await session.stream(
+            select(*EXPORT_COLUMNS)
+            .filter(Message.chat_id == chat_id)
+            .order_by(Message.seq)
+            .execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        async for partition in result.partitions():
+            chunk = "".join(_row_to_line(row) for row in partition).encode()
+            exported += len(partition)
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+                if not chunk:
+                    continue
+            yield chunk
+    if compressor is not None:
+        yield compressor.flush()
+    logger.info(f"Экспорт чата {chat_id} завершен: {exported} сообщений")
@@ -0,0 +1,229 @@
+import time
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.tables import chat_users
+
+import logging
+
+logger = logging.getLogger("mailbox")
+
+
+class UserMailbox:
+    """Ожидающие события одного пользователя: чат -> [message_id, seq, count, version].
+
+    version - номер последнего изменения записи в этом ящике, по нему клиент
+    подтверждает прочитанный кадр догонки. seen - чат -> seq, до которого
+    пользователь видел чаты с общей отметкой (см. Mailbox.advance).
+    """
+
+    __slots__ = ("entries", "version", "overflow", "seen")
+
+    def __init__(self):
+        self.entries: "OrderedDict[int, list]" = OrderedDict()
+        self.version = 0
+        self.overflow = False
+        self.seen: "OrderedDict[int, int]" = OrderedDict()
+
+
+class Mailbox:
+    """Почтовые ящики пользователей, у которых нет подписанного на чат сокета.
+
+    При отправке сообщения каждому такому участнику чата дописывается ссылка
+    на сообщение, а не оно само; записи одного чата схлопываются в одну
+    (последнее сообщение и счетчик). В ящике не больше max_chats чатов: при
+    переполнении вытесняется самый давний, а ящик помечается overflow, и
+    клиенту нужно перечитать список чатов целиком. Ящиков не больше max_users,
+    сверх этого вытесняются давно не обновлявшиеся.
+
+    Чаты в режиме pull и чаты, где участников больше max_fanout, по ящикам не
+    раскладываются: отправка стоила бы работы на каждого участника, а одно
+    сообщение в чат больше max_users вытеснило бы все ящики. Для них хранится
+    только общая отметка чата (последние message_id и seq), а в ящике
+    пользователя - seq, до которого он чат видел: он запоминается при
+    отключении и подтверждении догонки. При подключении отметки сравниваются
+    с seen, и разница попадает в тот же кадр catch_up. Пользователь, которого
+    этот процесс еще не видел, отметок не получает.
+
+    Ящики живут в памяти процесса, как и сокеты в ConnectionManager: это
+    подсказка, какие чаты перечитать после переподключения, а не журнал
+    доставки - история остается в БД.
+    """
+
+    def __init__(
+        self,
+        max_chats: int = 200,
+        max_users: int = 100_000,
+        members_ttl: float = 30.0,
+        max_fanout: int = 1000,
+        max_heads: int = 100_000,
+    ):
+        self.max_chats = max_chats
+        self.max_users = max_users
+        self.members_ttl = members_ttl
+        self.max_fanout = max_fanout
+        self.max_heads = max_heads
+        self._boxes: "OrderedDict[int, UserMailbox]" = OrderedDict()
+        self._members: Dict[int, Tuple[FrozenSet[int], float]] = {}
+        self._heads: "OrderedDict[int, Tuple[int, int]]" = OrderedDict()
+
+    async def members(self, session: AsyncSession, chat_id: int) -> FrozenSet[int]:
+        """Участники чата; кешируются на members_ttl секунд."""
+        entry = self._members.get(chat_id)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        members = frozenset(
+            (
+                await session.scalars(
+                    select(chat_users.c.user_id).where(chat_users.c.chat_id == chat_id)
+                )
+            ).all()
+        )
+        self._members[chat_id] = (members, time.monotonic() + self.members_ttl)
+        return members
+
+    def forget_members(self, chat_ids: Iterable[int]) -> None:
+        for chat_id in chat_ids:
+            self._members.pop(chat_id, None)
+
+    def _box(self, user_id: int) -> UserMailbox:
+        box = self._boxes.pop(user_id, None)
+        if box is None:
+            box = UserMailbox()
+        self._boxes[user_id] = box
+        return box
+
+    def _evict(self) -> None:
+        while len(self._boxes) > self.max_users:
+            user_id, _ = self._boxes.popitem(last=False)
+            logger.debug(f"Почтовый ящик пользователя {user_id} вытеснен")
+
+    def advance(self, chat_id: int, message_id: int, seq: int) -> None:
+        """Сдвигает общую отметку чата вместо записей в ящики участников."""
+        head = self._heads.pop(chat_id, None)
+        if head is None or seq >= head[1]:
+            head = (message_id, seq)
+        self._heads[chat_id] = head
+        if len(self._heads) > self.max_heads:
+            self._heads.popitem(last=False)
+
+    def mark_seen(self, user_id: int, chat_ids: Iterable[int]) -> None:
+        """Пользователь видел чаты chat_ids до их текущих отметок."""
+        heads = [(c, self._heads[c][1]) for c in chat_ids if c in self._heads]
+        if not heads:
+            return
+        box = self._box(user_id)
+        for chat_id, seq in heads:
+            box.seen.pop(chat_id, None)
+            box.seen[chat_id] = seq
+        while len(box.seen) > self.max_chats:
+            box.seen.popitem(last=False)
+        self._evict()
+
+    def append(
+        self, chat_id: int, message_id: int, seq: int, user_ids: Iterable[int]
+    ) -> None:
+        for user_id in user_ids:
+            box = self._box(user_id)
+            box.version += 1
+            entry = box.entries.pop(chat_id, None)
+            if entry is None:
+                entry = [message_id, seq, 0, 0]
+            if seq >= entry[1]:
+                entry[0], entry[1] = message_id, seq
+            entry[2] += 1
+            entry[3] = box.version
+            box.entries[chat_id] = entry
+            if len(box.entries) > self.max_chats:
+                box.entries.popitem(last=False)
+                box.overflow = True
+        self._evict()
+
+    def drain(
+        self, user_id: int, chat_ids: Iterable[int], complete: bool = False
+    ) -> Optional[dict]:
+        """Кадр догонки по чатам chat_ids или None, если ждать нечего.
+
+        Записи не удаляются, пока клиент не пришлет ack с курсором из кадра.
+        complete означает, что chat_ids - все чаты пользователя: записи
+        остальных чатов (удаленных, покинутых) тогда выбрасываются.
+        """
+        box = self._boxes.get(user_id)
+        if box is None:
+            return None
+        chat_ids = set(chat_ids)
+        if complete:
+            for chat_id in [c for c in box.entries if c not in chat_ids]:
+                del box.entries[chat_id]
+            for chat_id in [c for c in box.seen if c not in chat_ids]:
+                del box.seen[chat_id]
+        found = {
+            chat_id: {
+                "chat_id": chat_id,
+                "message_id": entry[0],
+                "seq": entry[1],
+                "count": entry[2],
+            }
+            for chat_id, entry in box.entries.items()
+            if chat_id in chat_ids
+        }
+        # seq в чате идут без пропусков, поэтому число новых сообщений по
+        # отметке - разница seq (с точностью до своих и удаленных).
+        for chat_id, seen in box.seen.items():
+            head = self._heads.get(chat_id)
+            if chat_id not in chat_ids or head is None or head[1] <= seen:
+                continue
+            item = found.get(chat_id)
+            if item is None or head[1] > item["seq"]:
+                found[chat_id] = {
+                    "chat_id": chat_id,
+                    "message_id": head[0],
+                    "seq": head[1],
+                    "count": max(head[1] - seen, item["count"] if item else 0),
+                }
+        chats = list(found.values())
+        if not chats and not box.overflow:
+            if not box.entries and not box.seen:
+                del self._boxes[user_id]
+            return None
+        return {
+            "type": "catch_up",
+            "chats": chats,
+            "overflow": box.overflow,
+            "cursor": box.version,
+        }
+
+    def ack(self, user_id: int, cursor: int, chat_ids: Iterable[int]) -> int:
+        """Удаляет записи chat_ids, не изменившиеся после курсора. Возвращает их число.
+
+        Запись, обновленная после выдачи кадра, имеет версию больше курсора
+        и остается в ящике до следующей догонки. Отметки chat_ids считаются
+        увиденными: после подтверждения сокет подписан, и новые сообщения
+        этих чатов приходят по нему.
+        """
+        box = self._boxes.get(user_id)
+        if box is None:
+            return 0
+        chat_ids = list(chat_ids)
+        removed = 0
+        for chat_id in chat_ids:
+            entry = box.entries.get(chat_id)
+            if entry is not None and entry[3] <= cursor:
+                del box.entries[chat_id]
+                removed += 1
+            if chat_id in box.seen and chat_id in self._heads:
+                box.seen[chat_id] = self._heads[chat_id][1]
+        if cursor >= box.version:
+            box.overflow = False
+        if not box.entries and not box.overflow and not box.seen:
+            del self._boxes[user_id]
+        return removed
+
+    def forget_user(self, user_id: int) -> None:
+        self._boxes.pop(user_id, None)
+
+    def __len__(self) -> int:
+        return len(self._boxes)
@@ -0,0 +1,78 @@
+from typing import List, Sequence
+
+from sqlalchemy import Integer, any_, bindparam, delete, func, literal, select
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.tables import User, chat_users, group_members
+
+import logging
+
+logger = logging.getLogger("membership")
+
+
+def ids_param(user_ids: Sequence[int]):
+    # Один параметр-массив вместо IN (...) с параметром на каждый id: текст
+    # запроса не зависит от размера пачки, и 10k id не упираются в лимит
+    # параметров asyncpg.
+    return bindparam(None, list(user_ids), type_=ARRAY(Integer))
+
+
+async def add_members(
+    session: AsyncSession, chat_id: int, group_id: int, user_ids: Sequence[int]
+) -> List[int]:
+    """Добавляет в группу существующих неудаленных пользователей.
+
+    Возвращает id тех, кто действительно добавлен: уже состоящие в чате
+    пропускаются через ON CONFLICT DO NOTHING, несуществующие - фильтром.
+    """
+    if not user_ids:
+        return []
+    added = (
+        await session.scalars(
+            insert(chat_users)
+            .from_select(
+                ["chat_id", "user_id"],
+                select(literal(chat_id), User.id).where(
+                    User.id == any_(ids_param(user_ids)), User.deleted_at.is_(None)
+                ),
+            )
+            .on_conflict_do_nothing()
+            .returning(chat_users.c.user_id)
+        )
+    ).all()
+    if added:
+        await session.execute(
+            insert(group_members)
+            .from_select(
+                ["group_id", "user_id"],
+                select(literal(group_id), func.unnest(ids_param(added))),
+            )
+            .on_conflict_do_nothing()
+        )
+    return list(added)
+
+
+async def remove_members(
+    session: AsyncSession, chat_id: int, group_id: int, user_ids: Sequence[int]
+) -> List[int]:
+    """Удаляет участников группы. Возвращает id тех, кто в ней действительно был."""
+    if not user_ids:
+        return []
+    removed = (
+        await session.scalars(
+            delete(chat_users)
+            .where(
+                chat_users.c.chat_id == chat_id,
+                chat_users.c.user_id == any_(ids_param(user_ids)),
+            )
+            .returning(chat_users.c.user_id)
+        )
+    ).all()
+    await session.execute(
+        delete(group_members).where(
+            group_members.c.group_id == group_id,
+            group_members.c.user_id == any_(ids_param(user_ids)),
+        )
+    )
+    return list(removed)
@@ -0,0 +1,108 @@
+import os
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.tables import Attachment, Message
+from app.service.attachments import attachment_meta
+from app.service.sequencer import ChatSequencer
+
+import logging
+
+logger = logging.getLogger("messages")
+
+sequencer = ChatSequencer(max_chats=int(os.getenv("SEQUENCER_MAX_CHATS", 100_000)))
+
+
+# Ограничение, конфликт по которому означает гонку за seq с другим воркером.
+SEQ_CONSTRAINT = "uq_messages_chat_id_seq"
+# SQLSTATE нарушения внешнего ключа.
+FOREIGN_KEY_VIOLATION = "23503"
+
+
+class SequenceConflict(Exception):
+    """Все попытки записи упали на конфликте seq: чат пишут слишком плотно,
+    отправку можно повторить."""
+
+
+class MissingReference(Exception):
+    """Чат (или вложение) удалили, пока сообщение записывалось: повторять
+    отправку бессмысленно."""
+
+
+def _constraint_name(e: IntegrityError) -> Optional[str]:
+    # asyncpg кладет имя ограничения в исходное исключение драйвера, которое
+    # адаптер SQLAlchemy сохраняет в __cause__.
+    for error in (e.orig, getattr(e.orig, "__cause__", None)):
+        name = getattr(error, "constraint_name", None)
+        if name:
+            return name
+    return None
+
+
+def is_seq_conflict(e: IntegrityError) -> bool:
+    return _constraint_name(e) == SEQ_CONSTRAINT
+
+
+def is_missing_reference(e: IntegrityError) -> bool:
+    return getattr(e.orig, "sqlstate", None) == FOREIGN_KEY_VIOLATION
+
+
+async def create_message(
+    session: AsyncSession,
+    chat_id: int,
+    sender_id: int,
+    text: str,
+    attachment_id: Optional[int] = None,
+    attempts: int = 2,
+) -> Message:
+    """Сохраняет сообщение со следующим seq чата.
+
+    Конфликт по (chat_id, seq) означает, что другой воркер успел записать в этот
+    чат; seq перечитывается из БД и вставка повторяется. Если конфликт остался
+    после attempts попыток, бросается SequenceConflict. Нарушение внешнего
+    ключа (чат удален во время запроса) - MissingReference, остальные ошибки
+    целостности пробрасываются как есть.
+    """
+    for attempt in range(attempts):
+        try:
+            async with sequencer.reserve(session, chat_id) as seq:
+                msg = Message(
+                    chat_id=chat_id,
+                    sender_id=sender_id,
+                    text=text,
+                    seq=seq,
+                    attachment_id=attachment_id,
+                    timestamp=datetime.utcnow(),
+                    client_message_id=str(uuid.uuid4()),
+                )
+                session.add(msg)
+                await session.commit()
+        except IntegrityError as e:
+            await session.rollback()
+            if is_missing_reference(e):
+                raise MissingReference(chat_id) from e
+            if not is_seq_conflict(e):
+                raise
+            if attempt == attempts - 1:
+                raise SequenceConflict(chat_id) from e
+            logger.warning(f"Конфликт seq в чате {chat_id}, повторная попытка")
+            continue
+        return msg
+
+
+def message_event(msg: Message, attachment: Optional[Attachment] = None) -> dict:
+    """Событие о новом сообщении; от вложения в нем только метаданные."""
+    return {
+        "type": "message",
+        "id": msg.id,
+        "seq": msg.seq,
+        "chat_id": msg.chat_id,
+        "sender_id": msg.sender_id,
+        "text": msg.text,
+        "timestamp": msg.timestamp.isoformat(),
+        "attachment": attachment_meta(attachment) if attachment is not None else None,
+    }
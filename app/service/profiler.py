@@ -0,0 +1,242 @@
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import random
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+
+import logging
+
+logger = logging.getLogger("profiler")
+
+PROFILE_HEADER = "x-profile"
+
+
+class ProfileRecord:
+    """Профиль одного запроса или WS-события: cProfile и статистика SQL."""
+
+    def __init__(self, kind: str, name: str, trigger: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.name = name
+        self.trigger = trigger
+        self.started_at = datetime.utcnow()
+        self.duration_ms = 0.0
+        self.status: Optional[int] = None
+        self.sql: Dict[str, List[float]] = {}
+        self.cpu_profile: Optional[str] = None
+
+    def add_statement(self, statement: str, elapsed: float) -> None:
+        stats = self.sql.get(statement)
+        if stats is None:
+            stats = self.sql[statement] = [0, 0.0, 0.0]
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "name": self.name,
+            "trigger": self.trigger,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(self.duration_ms, 3),
+            "status": self.status,
+            "sql_count": sum(stats[0] for stats in self.sql.values()),
+            "sql_ms": round(sum(stats[1] for stats in self.sql.values()) * 1000, 3),
+        }
+
+    def to_dict(self) -> dict:
+        statements = sorted(self.sql.items(), key=lambda item: item[1][1], reverse=True)
+        return {
+            **self.summary(),
+            "statements": [
+                {
+                    "statement": " ".join(statement.split()),
+                    "count": count,
+                    "total_ms": round(total * 1000, 3),
+                    "max_ms": round(longest * 1000, 3),
+                }
+                for statement, (count, total, longest) in statements
+            ],
+            "cpu_profile": self.cpu_profile,
+        }
+
+
+class ProfileStore:
+    """Последние max_items профилей; самые старые вытесняются."""
+
+    def __init__(self, max_items: int = 100):
+        self.max_items = max_items
+        self._records: "OrderedDict[str, ProfileRecord]" = OrderedDict()
+
+    def add(self, record: ProfileRecord) -> None:
+        self._records[record.id] = record
+        while len(self._records) > self.max_items:
+            self._records.popitem(last=False)
+
+    def get(self, record_id: str) -> Optional[ProfileRecord]:
+        return self._records.get(record_id)
+
+    def list(self) -> List[ProfileRecord]:
+        return list(reversed(self._records.values()))
+
+    def clear(self) -> None:
+        self._records.clear()
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+
+_current: ContextVar[Optional[ProfileRecord]] = ContextVar("profile_record", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("profile_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    record = _current.get()
+    if record is None:
+        return
+    started = conn.info.get("profile_started")
+    if started:
+        record.add_statement(statement, time.perf_counter() - started.pop())
+
+
+def _handle_error(exception_context):
+    started = exception_context.connection.info.get("profile_started") if exception_context.connection else None
+    if started and _current.get() is not None:
+        started.pop()
+
+
+class Profiler:
+    """Профилирование отдельных запросов по требованию.
+
+    Запрос профилируется, если в нем есть заголовок X-Profile с секретом
+    PROFILING_TOKEN, или случайно с вероятностью sample_rate. Для него
+    собираются cProfile и число и время SQL-запросов движков, к которым
+    подключен instrument(). cProfile один на поток, поэтому одновременно снимается
+    только один CPU-профиль, а в него попадают и корутины соседних запросов,
+    работавшие в то же время; SQL-статистика привязана к запросу через
+    contextvar и всегда точная.
+    """
+
+    def __init__(
+        self,
+        token: Optional[str] = None,
+        sample_rate: float = 0.0,
+        max_items: int = 100,
+        top: int = 40,
+    ):
+        self.token = token
+        self.sample_rate = sample_rate
+        self.top = top
+        self.store = ProfileStore(max_items)
+        self._cpu_busy = False
+
+    def instrument(self, engine) -> None:
+        sync_engine = getattr(engine, "sync_engine", engine)
+        if event.contains(sync_engine, "before_cursor_execute", _before_cursor_execute):
+            return
+        event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(sync_engine, "handle_error", _handle_error)
+
+    def requested(self, value: Optional[str]) -> bool:
+        return bool(self.token and value and hmac.compare_digest(value, self.token))
+
+    def trigger(self, forced: bool) -> Optional[str]:
+        if forced:
+            return "header"
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return "sample"
+        return None
+
+    @asynccontextmanager
+    async def profile(self, kind: str, name: str, forced: bool = False):
+        """Профилирует блок, если запрошено или выпала выборка; иначе отдает None."""
+        trigger = self.trigger(forced)
+        if trigger is None:
+            yield None
+            return
+        record = ProfileRecord(kind, name, trigger)
+        token = _current.set(record)
+        cpu = None
+        if not self._cpu_busy:
+            self._cpu_busy = True
+            cpu = cProfile.Profile()
+            cpu.enable()
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.duration_ms = (time.perf_counter() - started) * 1000
+            if cpu is not None:
+                cpu.disable()
+                self._cpu_busy = False
+                stream = io.StringIO()
+                pstats.Stats(cpu, stream=stream).sort_stats("cumulative").print_stats(self.top)
+                record.cpu_profile = stream.getvalue()
+            _current.reset(token)
+            self.store.add(record)
+            logger.info(
+                f"Профиль {record.id}: {kind} {name} {record.duration_ms:.1f} мс, "
+                f"SQL-запросов {record.summary()['sql_count']}"
+            )
+
+
+class ProfilingMiddleware:
+    """ASGI-middleware: профилирует HTTP-запрос вместе с отправкой тела ответа.
+
+    У профилированного ответа есть заголовок X-Profile-Id. WebSocket-события
+    профилируются отдельно, в обработчике сокета.
+    """
+
+    def __init__(self, app, profiler: Profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        header = None
+        for key, value in scope["headers"]:
+            if key == PROFILE_HEADER.encode():
+                header = value.decode("latin-1")
+                break
+        name = f"{scope['method']} {scope['path']}"
+        async with self.profiler.profile("http", name, self.profiler.requested(header)) as record:
+            if record is None:
+                await self.app(scope, receive, send)
+                return
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    record.status = message["status"]
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-profile-id", record.id.encode()))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+
+
+profiler = Profiler(
+    token=os.getenv("PROFILING_TOKEN") or None,
+    sample_rate=float(os.getenv("PROFILING_SAMPLE_RATE", 0)),
+    max_items=int(os.getenv("PROFILING_MAX_ITEMS", 100)),
+    top=int(os.getenv("PROFILING_TOP", 40)),
+)
@@ -0,0 +1,77 @@
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+
+class TokenBucketLimiter:
+    """Token bucket на ключ с ограниченным числом ключей.
+
+    Бакеты лежат в OrderedDict в порядке последнего обращения. Бакет, к которому
+    не обращались burst / rate секунд, снова полон и ничем не отличается от
+    отсутствующего, поэтому такие ключи удаляются без потери состояния.
+    Сверх max_keys вытесняются самые давние ключи.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.idle_ttl = burst / rate
+        self._buckets: "OrderedDict[Hashable, list]" = OrderedDict()
+
+    def _evict(self, now: float) -> None:
+        while self._buckets:
+            key, (_, updated) = next(iter(self._buckets.items()))
+            if len(self._buckets) > self.max_keys or now - updated >= self.idle_ttl:
+                del self._buckets[key]
+            else:
+                break
+
+    def acquire(self, key: Hashable, now: float = None) -> float:
+        """Забирает токен. Возвращает 0, если можно, иначе сколько секунд ждать."""
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.pop(key, None)
+        if bucket is None:
+            bucket = [self.burst, now]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        if tokens >= 1:
+            bucket[0], bucket[1] = tokens - 1, now
+            retry_after = 0.0
+        else:
+            bucket[0], bucket[1] = tokens, now
+            retry_after = (1 - tokens) / self.rate
+        self._buckets[key] = bucket
+        self._evict(now)
+        return retry_after
+
+    def refund(self, key: Hashable) -> None:
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket[0] = min(self.burst, bucket[0] + 1)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class MessageRateLimiter:
+    """Лимиты на входящие сообщения: отдельно на пользователя и на чат."""
+
+    def __init__(
+        self,
+        user_rate: float,
+        user_burst: float,
+        chat_rate: float,
+        chat_burst: float,
+        max_keys: int = 100_000,
+    ):
+        self.users = TokenBucketLimiter(user_rate, user_burst, max_keys)
+        self.chats = TokenBucketLimiter(chat_rate, chat_burst, max_keys)
+
+    def acquire(self, user_id: int, chat_id: int) -> float:
+        retry_after = self.users.acquire(user_id)
+        if retry_after:
+            return retry_after
+        retry_after = self.chats.acquire(chat_id)
+        if retry_after:
+            self.users.refund(user_id)
+        return retry_after
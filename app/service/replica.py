@@ -0,0 +1,105 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+import logging
+
+logger = logging.getLogger("replica")
+
+LAG_QUERY = text(
+    """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE coalesce(
+            extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0
+        )
+    END
+    """
+)
+
+
+class ReplicaRouter:
+    """Решает, можно ли отправить чтение на реплику.
+
+    Реплика проверяется не чаще раза в check_interval секунд: доступна ли она
+    и насколько отстает. При ошибке или отставании больше max_lag чтения идут
+    на primary. Пользователь, который только что писал, sticky_window секунд
+    читает с primary, чтобы увидеть свои же изменения.
+    """
+
+    def __init__(
+        self,
+        engine: Optional[AsyncEngine],
+        max_lag: float = 5.0,
+        check_interval: float = 5.0,
+        check_timeout: float = 1.0,
+        sticky_window: float = 10.0,
+        max_sticky_users: int = 100_000,
+    ):
+        self.engine = engine
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self.sticky_window = sticky_window
+        self.max_sticky_users = max_sticky_users
+        self.healthy = False
+        self.lag: Optional[float] = None
+        self._checked_at = float("-inf")
+        self._check_lock = asyncio.Lock()
+        self._sticky: "OrderedDict[int, float]" = OrderedDict()
+
+    async def _read_lag(self) -> float:
+        async with self.engine.connect() as conn:
+            return await conn.scalar(LAG_QUERY)
+
+    async def check(self) -> bool:
+        # Таймаут покрывает и подключение: недоступный хост реплики иначе
+        # держал бы _check_lock, а с ним и все чтения, до таймаута asyncpg.
+        try:
+            lag = await asyncio.wait_for(self._read_lag(), timeout=self.check_timeout)
+        except Exception as e:
+            if self.healthy:
+                logger.warning(f"Реплика недоступна, чтение идет на primary: {e!r}")
+            self.healthy, self.lag = False, None
+        else:
+            self.lag = float(lag)
+            healthy = self.lag <= self.max_lag
+            if healthy != self.healthy:
+                logger.warning(f"Реплика {'в строю' if healthy else 'отстает'}: lag={self.lag:.1f}s")
+            self.healthy = healthy
+        self._checked_at = time.monotonic()
+        return self.healthy
+
+    async def _ensure_checked(self) -> bool:
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return self.healthy
+        async with self._check_lock:
+            if time.monotonic() - self._checked_at >= self.check_interval:
+                await self.check()
+        return self.healthy
+
+    def mark_write(self, user_id: int) -> None:
+        now = time.monotonic()
+        self._sticky.pop(user_id, None)
+        self._sticky[user_id] = now + self.sticky_window
+        while self._sticky:
+            oldest, until = next(iter(self._sticky.items()))
+            if until > now and len(self._sticky) <= self.max_sticky_users:
+                break
+            del self._sticky[oldest]
+
+    def is_sticky(self, user_id: int) -> bool:
+        until = self._sticky.get(user_id)
+        return until is not None and until > time.monotonic()
+
+    async def use_replica(self, user_id: Optional[int] = None) -> bool:
+        if self.engine is None:
+            return False
+        if user_id is not None and self.is_sticky(user_id):
+            return False
+        return await self._ensure_checked()
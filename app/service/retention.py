@@ -0,0 +1,313 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Optional
+
+from sqlalchemy import bindparam, delete, func, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import AsyncSessionLocal
+from app.models.tables import (
+    Attachment,
+    Chat,
+    Group,
+    Message,
+    User,
+    chat_users,
+    group_members,
+)
+from app.service.versions import versions
+
+import logging
+
+logger = logging.getLogger("retention")
+
+# Ключ pg_try_advisory_lock: в каждом проходе участвует только один воркер.
+ADVISORY_LOCK_KEY = 0x6D736770
+
+
+class RetentionPurger:
+    """Фоновая очистка сообщений по сроку хранения и удаление чатов и пользователей.
+
+    Срок хранения - chats.retention_days, а если он не задан, общий
+    global_days (None - хранить вечно). Удаленные чаты и пользователи только
+    помечаются deleted_at, а строки убирает этот же проход. Сообщения всегда
+    удаляются пачками по batch_size id в порядке ключа, каждая пачка в своей
+    короткой транзакции, с паузой pause между пачками, поэтому блокировки
+    держатся недолго, а WAL растет равномерно.
+    """
+
+    def __init__(
+        self,
+        sessionmaker: Callable[[], AsyncSession] = AsyncSessionLocal,
+        global_days: Optional[int] = None,
+        batch_size: int = 1000,
+        pause: float = 0.05,
+        interval: float = 3600.0,
+        chat_page: int = 1000,
+    ):
+        self.sessionmaker = sessionmaker
+        self.global_days = global_days
+        self.batch_size = batch_size
+        self.pause = pause
+        self.interval = interval
+        self.chat_page = chat_page
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self.stats = {
+            "running": False,
+            "passes": 0,
+            "batches": 0,
+            "messages_deleted": 0,
+            "chats_deleted": 0,
+            "users_deleted": 0,
+            "chats_scanned": 0,
+            "last_pass_started_at": None,
+            "last_pass_seconds": None,
+            "last_error": None,
+        }
+
+    async def _delete_batches(
+        self, fetch: Callable[[AsyncSession], Awaitable[List[int]]]
+    ) -> int:
+        """Удаляет сообщения пачками, пока fetch возвращает id.
+
+        fetch отдает не больше batch_size id в порядке ключа. В той же
+        транзакции, что и удаление пачки, у затронутых чатов purged_seq
+        поднимается до наибольшего удаленного seq - иначе после удаления
+        последних сообщений чата seq выдавались бы повторно (см.
+        ChatSequencer._load), - а purge_version растет: он входит в ETag
+        истории, и закешированные клиентами страницы с удаленными сообщениями
+        перестают совпадать.
+        """
+        chats = Chat.__table__
+        mark_purged = (
+            update(chats)
+            .where(chats.c.id == bindparam("purged_chat_id"))
+            .values(
+                purged_seq=func.greatest(chats.c.purged_seq, bindparam("purged_max_seq")),
+                purge_version=chats.c.purge_version + 1,
+            )
+        )
+        deleted = 0
+        while True:
+            async with self.sessionmaker() as session:
+                ids = await fetch(session)
+                if not ids:
+                    break
+                purged = {}
+                for chat_id, seq in await session.execute(
+                    delete(Message)
+                    .where(Message.id.in_(ids))
+                    .returning(Message.chat_id, Message.seq)
+                ):
+                    purged[chat_id] = max(seq, purged.get(chat_id, seq))
+                await session.execute(
+                    mark_purged,
+                    [
+                        {"purged_chat_id": chat_id, "purged_max_seq": seq}
+                        for chat_id, seq in purged.items()
+                    ],
+                )
+                await session.commit()
+            versions.invalidate_chats(purged)
+            deleted += len(ids)
+            self.stats["batches"] += 1
+            self.stats["messages_deleted"] += len(ids)
+            if len(ids) < self.batch_size:
+                break
+            await asyncio.sleep(self.pause)
+        return deleted
+
+    async def purge_expired(self, chat_id: int, days: int) -> int:
+        """Удаляет сообщения чата старше days дней.
+
+        seq растет вместе со временем создания, поэтому устаревшие сообщения -
+        префикс по (chat_id, seq): пачка читается по уникальному индексу без
+        фильтра, и из нее берется только устаревшее начало. Чат без устаревших
+        сообщений стоит одного короткого чтения индекса.
+        """
+        cutoff = datetime.utcnow() - timedelta(days=days)
+
+        async def fetch(session: AsyncSession) -> List[int]:
+            rows = await session.execute(
+                select(Message.id, Message.created_at)
+                .where(Message.chat_id == chat_id)
+                .order_by(Message.seq)
+                .limit(self.batch_size)
+            )
+            ids = []
+            for message_id, created_at in rows:
+                if created_at is None or created_at >= cutoff:
+                    break
+                ids.append(message_id)
+            return ids
+
+        return await self._delete_batches(fetch)
+
+    async def purge_chat(self, chat_id: int) -> None:
+        """Удаляет помеченный чат: сообщения пачками, затем группу и сам чат."""
+
+        async def fetch(session: AsyncSession) -> List[int]:
+            return (
+                await session.scalars(
+                    select(Message.id)
+                    .where(Message.chat_id == chat_id)
+                    .order_by(Message.seq)
+                    .limit(self.batch_size)
+                )
+            ).all()
+
+        await self._delete_batches(fetch)
+        async with self.sessionmaker() as session:
+            group_ids = select(Group.id).where(Group.chat_id == chat_id)
+            await session.execute(
+                delete(group_members).where(group_members.c.group_id.in_(group_ids))
+            )
+            await session.execute(delete(Group).where(Group.chat_id == chat_id))
+            await session.execute(delete(chat_users).where(chat_users.c.chat_id == chat_id))
+            await session.execute(delete(Chat).where(Chat.id == chat_id))
+            await session.commit()
+        self.stats["chats_deleted"] += 1
+        logger.info(f"Удален чат {chat_id}")
+
+    async def purge_user(self, user_id: int) -> None:
+        """Удаляет помеченного пользователя: его сообщения пачками, затем членства."""
+
+        async def fetch(session: AsyncSession) -> List[int]:
+            return (
+                await session.scalars(
+                    select(Message.id)
+                    .where(Message.sender_id == user_id)
+                    .order_by(Message.id)
+                    .limit(self.batch_size)
+                )
+            ).all()
+
+        await self._delete_batches(fetch)
+        async with self.sessionmaker() as session:
+            await session.execute(delete(chat_users).where(chat_users.c.user_id == user_id))
+            await session.execute(delete(group_members).where(group_members.c.user_id == user_id))
+            await session.execute(
+                update(Group).where(Group.creator_id == user_id).values(creator_id=None)
+            )
+            await session.execute(
+                update(Attachment)
+                .where(Attachment.uploader_id == user_id)
+                .values(uploader_id=None)
+            )
+            await session.execute(delete(User).where(User.id == user_id))
+            await session.commit()
+        self.stats["users_deleted"] += 1
+        logger.info(f"Удален пользователь {user_id}")
+
+    async def _marked(self, model) -> List[int]:
+        async with self.sessionmaker() as session:
+            return (
+                await session.scalars(
+                    select(model.id).where(model.deleted_at.isnot(None)).order_by(model.id)
+                )
+            ).all()
+
+    async def _retention_pages(self):
+        """Чаты с действующим сроком хранения страницами по id."""
+        days = Chat.retention_days
+        if self.global_days:
+            days = func.coalesce(Chat.retention_days, self.global_days)
+        last_id = 0
+        while True:
+            async with self.sessionmaker() as session:
+                q = (
+                    select(Chat.id, days)
+                    .where(Chat.id > last_id, Chat.deleted_at.is_(None))
+                    .order_by(Chat.id)
+                    .limit(self.chat_page)
+                )
+                if not self.global_days:
+                    q = q.where(Chat.retention_days.isnot(None))
+                page = (await session.execute(q)).all()
+            if not page:
+                return
+            yield page
+            last_id = page[-1][0]
+
+    async def run_once(self) -> None:
+        async with self.sessionmaker() as lock_session:
+            conn = await lock_session.connection(
+                execution_options={"isolation_level": "AUTOCOMMIT"}
+            )
+            locked = await conn.scalar(
+                text("SELECT pg_try_advisory_lock(:key)"), {"key": ADVISORY_LOCK_KEY}
+            )
+            if not locked:
+                logger.info("Очистку уже выполняет другой воркер")
+                return
+            try:
+                await self._run_pass()
+            finally:
+                await conn.execute(
+                    text("SELECT pg_advisory_unlock(:key)"), {"key": ADVISORY_LOCK_KEY}
+                )
+
+    async def _run_pass(self) -> None:
+        started = time.monotonic()
+        self.stats["running"] = True
+        self.stats["last_pass_started_at"] = datetime.utcnow().isoformat()
+        deleted_before = self.stats["messages_deleted"]
+        try:
+            for chat_id in await self._marked(Chat):
+                await self.purge_chat(chat_id)
+            for user_id in await self._marked(User):
+                await self.purge_user(user_id)
+            async for page in self._retention_pages():
+                for chat_id, days in page:
+                    self.stats["chats_scanned"] += 1
+                    await self.purge_expired(chat_id, days)
+        finally:
+            self.stats["running"] = False
+            self.stats["passes"] += 1
+            self.stats["last_pass_seconds"] = round(time.monotonic() - started, 3)
+        logger.info(
+            f"Проход очистки: удалено сообщений "
+            f"{self.stats['messages_deleted'] - deleted_before} "
+            f"за {self.stats['last_pass_seconds']} с"
+        )
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.stats["last_error"] = repr(e)
+                logger.exception("Ошибка прохода очистки")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def wake(self) -> None:
+        """Запускает следующий проход сразу, например после удаления чата."""
+        self._wakeup.set()
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+purger = RetentionPurger(
+    global_days=int(os.getenv("RETENTION_DAYS", 0)) or None,
+    batch_size=int(os.getenv("RETENTION_BATCH_SIZE", 1000)),
+    pause=float(os.getenv("RETENTION_PAUSE", 0.05)),
+    interval=float(os.getenv("RETENTION_INTERVAL", 3600)),
+)
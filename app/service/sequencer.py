@@ -0,0 +1,73 @@
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.tables import Chat, Message
+
+
+class ChatSequencer:
+    """Выдает сообщениям чата монотонный seq без пропусков.
+
+    Следующее значение держится в памяти; при первом обращении к чату оно
+    восстанавливается из max(seq) по уникальному индексу (chat_id, seq) - это и
+    есть долговременная отметка. Записи в один чат внутри процесса идут по
+    очереди под asyncio.Lock этого чата, разные чаты друг друга не ждут, общей
+    горячей строки в БД нет. Если вставка не удалась (в том числе конфликт
+    с другим воркером по уникальному индексу), значение из памяти сбрасывается
+    и при следующей попытке перечитывается из БД.
+
+    В памяти не больше max_chats значений, давно не писавшиеся чаты
+    вытесняются и при следующей записи перечитываются из БД. Lock чата живет,
+    только пока в чат кто-то пишет или ждет очереди.
+    """
+
+    def __init__(self, max_chats: int = 100_000):
+        self.max_chats = max_chats
+        self._next: "OrderedDict[int, int]" = OrderedDict()
+        # chat_id -> [lock, число держащих и ждущих]
+        self._locks: Dict[int, List] = {}
+
+    async def _load(self, session: AsyncSession, chat_id: int) -> int:
+        # purged_seq не дает seq начаться заново, если очистка по сроку
+        # хранения удалила все сообщения чата.
+        current = await session.scalar(
+            select(
+                func.greatest(
+                    select(func.coalesce(func.max(Message.seq), 0))
+                    .where(Message.chat_id == chat_id)
+                    .scalar_subquery(),
+                    Chat.purged_seq,
+                )
+            ).where(Chat.id == chat_id)
+        )
+        return (current or 0) + 1
+
+    @asynccontextmanager
+    async def reserve(self, session: AsyncSession, chat_id: int) -> AsyncIterator[int]:
+        entry = self._locks.get(chat_id)
+        if entry is None:
+            entry = self._locks[chat_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                seq = self._next.pop(chat_id, None)
+                if seq is None:
+                    seq = await self._load(session, chat_id)
+                yield seq
+                self._next[chat_id] = seq + 1
+                if len(self._next) > self.max_chats:
+                    self._next.popitem(last=False)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[chat_id]
+
+    def forget(self, chat_id: int) -> None:
+        self._next.pop(chat_id, None)
+
+    def __len__(self) -> int:
+        return len(self._next)
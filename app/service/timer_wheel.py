@@ -0,0 +1,145 @@
+import asyncio
+import inspect
+import time
+from typing import Callable, List, Optional, Set
+
+import logging
+
+logger = logging.getLogger("timer_wheel")
+
+
+class Timer:
+    __slots__ = ("deadline", "callback", "bucket")
+
+    def __init__(self, deadline: int, callback: Callable):
+        self.deadline = deadline
+        self.callback = callback
+        self.bucket: Optional[Set["Timer"]] = None
+
+    def cancel(self) -> None:
+        if self.bucket is not None:
+            self.bucket.discard(self)
+            self.bucket = None
+
+
+class TimerWheel:
+    """Иерархическое колесо таймеров на одной фоновой задаче.
+
+    Время дискретно: tick секунд на деление. Уровень l хранит таймеры со сроком
+    меньше slots ** (l + 1) делений; когда нижний уровень проходит полный оборот,
+    очередная ячейка верхнего уровня раскладывается вниз. Постановка и отмена
+    таймера - O(1), а на каждый тик разбирается одна ячейка, сколько бы
+    таймеров ни было запланировано.
+
+    Асинхронные колбэки выполняются отдельными задачами, не больше
+    max_concurrency одновременно: медленный колбэк (отправка в зависший
+    сокет) не задерживает тики и остальные таймеры.
+    """
+
+    def __init__(
+        self,
+        tick: float = 1.0,
+        slots: int = 64,
+        levels: int = 3,
+        max_concurrency: int = 1000,
+    ):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.current = 0
+        self._wheels: List[List[Set[Timer]]] = [
+            [set() for _ in range(slots)] for _ in range(levels)
+        ]
+        self._task: Optional[asyncio.Task] = None
+        self.max_concurrency = max_concurrency
+        self._limit: Optional[asyncio.Semaphore] = None
+        self._running: Set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return sum(len(bucket) for wheel in self._wheels for bucket in wheel)
+
+    def _place(self, timer: Timer) -> None:
+        delta = max(timer.deadline - self.current, 0)
+        level = 0
+        while level < self.levels - 1 and delta >= self.slots ** (level + 1):
+            level += 1
+        deadline = min(timer.deadline, self.current + self.slots ** self.levels - 1)
+        bucket = self._wheels[level][(deadline // self.slots ** level) % self.slots]
+        bucket.add(timer)
+        timer.bucket = bucket
+
+    def schedule(self, delay: float, callback: Callable) -> Timer:
+        ticks = max(1, int(-(-delay // self.tick)))
+        timer = Timer(self.current + ticks, callback)
+        self._place(timer)
+        return timer
+
+    def advance(self) -> List[Callable]:
+        """Сдвигает колесо на одно деление и возвращает сработавшие колбэки."""
+        self.current += 1
+        for level in range(1, self.levels):
+            if self.current % self.slots ** level:
+                break
+            bucket = self._wheels[level][(self.current // self.slots ** level) % self.slots]
+            timers = list(bucket)
+            bucket.clear()
+            for timer in timers:
+                self._place(timer)
+
+        bucket = self._wheels[0][self.current % self.slots]
+        due = []
+        for timer in list(bucket):
+            if timer.deadline <= self.current:
+                bucket.discard(timer)
+                timer.bucket = None
+                due.append(timer.callback)
+        return due
+
+    def _fire(self, callbacks: List[Callable]) -> None:
+        for callback in callbacks:
+            try:
+                result = callback()
+            except Exception:
+                logger.exception("Ошибка в колбэке таймера")
+                continue
+            if inspect.isawaitable(result):
+                task = asyncio.create_task(self._run_callback(result))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+    async def _run_callback(self, awaitable) -> None:
+        if self._limit is None:
+            self._limit = asyncio.Semaphore(self.max_concurrency)
+        try:
+            async with self._limit:
+                await awaitable
+        except Exception as e:
+            logger.error(f"Ошибка в колбэке таймера: {e!r}")
+        finally:
+            # Корутина, отмененная до получения слота, так и не запускалась.
+            if inspect.iscoroutine(awaitable):
+                awaitable.close()
+
+    async def run(self) -> None:
+        next_tick = time.monotonic()
+        while True:
+            next_tick += self.tick
+            await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+            self._fire(self.advance())
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._running):
+            task.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
+        self._running.clear()
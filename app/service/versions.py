@@ -0,0 +1,109 @@
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import any_, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.tables import Chat, Message, User
+from app.service.membership import ids_param
+
+
+class VersionTracker:
+    """Дешевые маркеры версий для ETag истории и списка чатов.
+
+    Версия чата - seq последнего сообщения вместе с purged_seq и purge_version
+    чата: очистка удаляет сообщения, не меняя последний seq. Версия списка
+    чатов пользователя - счетчик users.chats_version, который растет в той же
+    транзакции, что и изменение списка (bump_users), поэтому проверка стоит
+    одного чтения по первичному ключу. Маркеры хранятся в памяти процесса:
+    записи этого воркера обновляют их сразу, а значения, прочитанные из БД,
+    живут ttl секунд, чтобы подхватывать записи и очистки других воркеров.
+    """
+
+    def __init__(self, ttl: float = 2.0):
+        self.ttl = ttl
+        self._chats: Dict[int, Tuple[int, str, float]] = {}
+        self._users: Dict[int, Tuple[str, float]] = {}
+
+    def _fresh(self, entry: Optional[tuple]) -> bool:
+        return entry is not None and entry[-1] > time.monotonic()
+
+    async def chat_version(
+        self, session: AsyncSession, chat_id: int, cached: bool = True
+    ) -> str:
+        """cached=False - версия читается из session и в кеш не попадает: так
+        делают чтения с реплики, чтобы маркер описывал те же данные, что и
+        отданные строки, а не опережающие их записи primary."""
+        entry = self._chats.get(chat_id)
+        if cached and self._fresh(entry):
+            return f"{entry[0]}.{entry[1]}"
+        last_seq = (
+            select(func.coalesce(func.max(Message.seq), 0))
+            .where(Message.chat_id == chat_id)
+            .scalar_subquery()
+        )
+        row = (
+            await session.execute(
+                select(last_seq, Chat.purged_seq, Chat.purge_version).where(
+                    Chat.id == chat_id
+                )
+            )
+        ).first()
+        seq, purged = (row[0], f"{row[1]}.{row[2]}") if row else (0, "0.0")
+        if cached:
+            self._chats[chat_id] = (seq, purged, time.monotonic() + self.ttl)
+        return f"{seq}.{purged}"
+
+    def bump_chat(self, chat_id: int, seq: int) -> None:
+        # Срок записи не продлевается: иначе у чата, куда постоянно пишут,
+        # маркер никогда не перечитывался бы из БД и не увидел бы очистку,
+        # выполненную другим воркером.
+        entry = self._chats.get(chat_id)
+        if entry is not None:
+            self._chats[chat_id] = (max(seq, entry[0]), entry[1], entry[2])
+
+    def invalidate_chats(self, chat_ids) -> None:
+        for chat_id in chat_ids:
+            self._chats.pop(chat_id, None)
+
+    async def user_chats_version(
+        self, session: AsyncSession, user_id: int, cached: bool = True
+    ) -> str:
+        entry = self._users.get(user_id)
+        if cached and self._fresh(entry):
+            return entry[0]
+        version = str(
+            await session.scalar(select(User.chats_version).where(User.id == user_id))
+        )
+        if cached:
+            self._users[user_id] = (version, time.monotonic() + self.ttl)
+        return version
+
+    async def bump_users(self, session: AsyncSession, user_ids) -> None:
+        """Увеличивает версию списка чатов пользователей в транзакции session.
+
+        Вызывается вместе с изменением, которое меняет их список чатов;
+        после коммита кеш этого процесса сбрасывает invalidate_users.
+        """
+        user_ids = sorted(set(user_ids))
+        if user_ids:
+            await session.execute(
+                update(User)
+                .where(User.id == any_(ids_param(user_ids)))
+                .values(chats_version=User.chats_version + 1)
+            )
+
+    def invalidate_users(self, user_ids) -> None:
+        for user_id in user_ids:
+            self._users.pop(user_id, None)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+versions = VersionTracker(ttl=float(os.getenv("ETAG_VERSION_TTL", 2)))
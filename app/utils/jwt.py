@@ -2,7 +2,6 @@ import os
 from datetime import datetime, timedelta
 from typing import Optional
 
-from dotenv import load_dotenv
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from fastapi.websockets import WebSocketDisconnect
@@ -13,14 +12,8 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.db import get_async_session
 from app.models.tables import User
 
-load_dotenv()
-
 import logging
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s"
-)
 logger = logging.getLogger("jwt_utils")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
@@ -72,7 +65,7 @@ async def get_current_user_ws(token: str, session: AsyncSession):
         raise WebSocketDisconnect(code=1008)
 
     user = await session.get(User, user_id)
-    if not user:
+    if not user or user.deleted_at is not None:
         raise WebSocketDisconnect(code=1008)
     return user
 
@@ -97,7 +90,7 @@ async def get_current_user(
             detail="Invalid token payload",
         )
     user = await session.get(User, user_id)
-    if not user:
+    if not user or user.deleted_at is not None:
         logger.warning(f"Пользователь не найден: {user_id}")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
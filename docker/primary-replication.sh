@@ -0,0 +1,6 @@
+#!/bin/bash
+set -e
+
+# Разрешает потоковую репликацию для docker-compose.replica.yml.
+# Выполняется образом postgres только при инициализации пустого тома.
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"